@@ -4,6 +4,7 @@
 import re, json, logging, functools
 
 from lib.web import ctx
+from lib.db import Row
 
 
 def api(func):
@@ -37,13 +38,26 @@ def _dump(obj):
             'page_count': obj.page_count,
             'item_count': obj.item_count,
             'has_next': obj.has_next,
-            'has_previous': obj.has_previous
+            'has_previous': obj.has_previous,
+            'next': obj.next,
+            'previous': obj.previous
         }
+    if isinstance(obj, Row):
+        return dict(obj.items())
     raise TypeError('%s is not JSON serializable' % obj)
 
 
 
 class Page(object):
+    '''
+    A page by offset (page_index), or by cursor if made by Page.from_cursors().
+    next and previous are the opaque cursors of the adjacent pages, or None.
+    A page by cursor has no position: its item_count, page_count and
+    page_index are None.
+    '''
+
+    next = None
+    previous = None
 
     def __init__(self, item_count, page_index=1, page_size=15):
         self.item_count = item_count
@@ -60,6 +74,18 @@ class Page(object):
         self.has_next = self.page_index < self.page_count
         self.has_previous = self.page_index > 1
 
+    @classmethod
+    def from_cursors(cls, next, previous, page_size=15):
+        '''
+        Make a page for Model.find_page(), which does not count the items.
+        '''
+        page = cls(0, page_size=page_size)
+        page.item_count = page.page_count = page.page_index = None
+        page.limit = page_size
+        page.next, page.previous = next, previous
+        page.has_next, page.has_previous = next is not None, previous is not None
+        return page
+
     def __str__(self):
         return 'item_count: %s, page_count: %s, page_index: %s, page_size: %s, offset: %s, limit: %s' % (self.item_count, self.page_count, self.page_index, self.page_size, self.offset, self.limit)
 
@@ -0,0 +1,108 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+'''
+Fingerprinted static assets.
+
+`python assets.py` copies every file under static/ to static/dist/, named by
+a hash of its content (js/ymtx.js -> dist/js/ymtx.0123abcdef.js), writes a
+.gz variant of text files next to each copy, and records the names in
+static/dist/manifest.json. Templates link to assets by asset_url('js/ymtx.js'),
+which returns the fingerprinted url if the manifest has one. Fingerprinted
+files never change, so StaticFileRoute lets clients cache them for a year.
+'''
+
+import os, sys, json, gzip, shutil, hashlib, logging
+
+STATIC_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'static')
+DIST = 'dist'
+MANIFEST = os.path.join(STATIC_DIR, DIST, 'manifest.json')
+
+_COMPRESSIBLE = frozenset(['.js', '.css', '.html', '.svg', '.txt', '.json', '.xml'])
+
+
+def fingerprint(path, digest):
+    '''
+    >>> fingerprint('js/jquery.min.js', '0123abcdef')
+    'js/jquery.min.0123abcdef.js'
+    '''
+    base, ext = os.path.splitext(path)
+    return '%s.%s%s' % (base, digest, ext)
+
+
+def build(static_dir=STATIC_DIR):
+    '''
+    Write the fingerprinted and compressed copies of the files under
+    static_dir, and the manifest. Copies of earlier versions are kept, as
+    cached pages may still link to them. Return the manifest.
+    '''
+    dist = os.path.join(static_dir, DIST)
+    manifest = {}
+    for root, dirs, files in os.walk(static_dir):
+        if root == static_dir and DIST in dirs:
+            dirs.remove(DIST)
+        for name in files:
+            src = os.path.join(root, name)
+            path = os.path.relpath(src, static_dir).replace(os.sep, '/')
+            with open(src, 'rb') as f:
+                digest = hashlib.md5(f.read()).hexdigest()[:10]
+            target = '%s/%s' % (DIST, fingerprint(path, digest))
+            dst = os.path.join(static_dir, *target.split('/'))
+            if not os.path.isfile(dst):
+                if not os.path.isdir(os.path.dirname(dst)):
+                    os.makedirs(os.path.dirname(dst))
+                shutil.copyfile(src, dst)
+                if os.path.splitext(name)[1].lower() in _COMPRESSIBLE:
+                    _compress(dst)
+            manifest[path] = target
+    if not os.path.isdir(dist):
+        os.makedirs(dist)
+    with open(os.path.join(dist, 'manifest.json'), 'wb') as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    return manifest
+
+
+def _compress(path):
+    '''
+    Write path.gz, unless gzip does not make it smaller.
+    '''
+    gz = path + '.gz'
+    with open(path, 'rb') as src:
+        data = src.read()
+    f = gzip.GzipFile(gz, 'wb', 9, mtime=0)
+    try:
+        f.write(data)
+    finally:
+        f.close()
+    if os.path.getsize(gz) >= len(data):
+        os.remove(gz)
+
+
+_manifest = None
+
+def _load_manifest():
+    global _manifest
+    try:
+        with open(MANIFEST, 'rb') as f:
+            _manifest = json.load(f)
+    except IOError:
+        logging.warning('no %s, run assets.py to fingerprint static files.' % MANIFEST)
+        _manifest = {}
+    return _manifest
+
+
+def asset_url(path):
+    '''
+    Url of the static file at path, relative to static/, fingerprinted if
+    it is in the manifest.
+    '''
+    manifest = _manifest if _manifest is not None else _load_manifest()
+    path = path.lstrip('/')
+    if path.startswith('static/'):
+        path = path[7:]
+    return '/static/' + manifest.get(path, path)
+
+
+if __name__ == '__main__':
+    manifest = build()
+    print 'fingerprinted %d files into %s.' % (len(manifest), os.path.join(STATIC_DIR, DIST))
@@ -0,0 +1,63 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+'''
+Per-row cost of converting a 10k-row `select * from blog` result to Python
+types, using per-cell to_python() lookups as before and the converters
+compiled once per result set.
+
+    python bench/bench_convert.py [rows]
+'''
+
+import os, sys, time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'vendor'))
+
+from mysql.connector.constants import FieldType, FieldFlag
+from mysql.connector.conversion import MySQLConverter
+from mysql.connector.cursor import MySQLCursorBuffered
+
+# description of the blog table: id, name, content, created_at
+_BLOG_DESCRIPTION = [
+    ('id', FieldType.VAR_STRING, None, None, None, None, 0, FieldFlag.NOT_NULL | FieldFlag.PRI_KEY),
+    ('name', FieldType.VAR_STRING, None, None, None, None, 0, FieldFlag.NOT_NULL),
+    ('content', FieldType.BLOB, None, None, None, None, 0, FieldFlag.NOT_NULL | FieldFlag.BLOB),
+    ('created_at', FieldType.DOUBLE, None, None, None, None, 0, FieldFlag.NOT_NULL),
+]
+
+
+class _Connection(object):
+
+    def __init__(self):
+        self.converter = MySQLConverter('utf8', True)
+        self._protocol = None
+        self.unread_result = False
+
+
+def _row_to_python_per_cell(cursor, rowdata):
+    '''
+    The conversion before compiled converters, kept for comparison.
+    '''
+    res = ()
+    desc = cursor.description
+    for idx, v in enumerate(rowdata):
+        res += (cursor._connection.converter.to_python(desc[idx], v), )
+    return res
+
+
+def main(rows=10000):
+    rows = [('%015d' % i, 'blog %d' % i, 'content ' * 100, '%s.123' % (1400000000 + i)) for i in xrange(rows)]
+    connection = _Connection()
+    cursor = MySQLCursorBuffered(connection)
+    cursor._description = _BLOG_DESCRIPTION
+    cursor._converters = cursor._compile_converters(_BLOG_DESCRIPTION)
+    assert _row_to_python_per_cell(cursor, rows[0]) == cursor._row_to_python(rows[0])
+    for name, fn in (('per cell', lambda row: _row_to_python_per_cell(cursor, row)), ('compiled', cursor._row_to_python)):
+        start = time.time()
+        for row in rows:
+            fn(row)
+        t = time.time() - start
+        print '%-9s %d rows: %.4fs (%.2fus/row)' % (name, len(rows), t, t * 1e6 / len(rows))
+
+if __name__ == '__main__':
+    main(*[int(a) for a in sys.argv[1:]])
@@ -0,0 +1,63 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+'''
+Re-render time of a long post after editing one paragraph, with Markdown
+and with IncrementalMarkdown, for growing post sizes.
+
+    python bench/bench_markdown_incremental.py
+'''
+
+import os, sys, time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import markdown2
+
+_SECTION = '''## Section %(i)d
+
+Some *emphasis*, **strong** text, `code`, a [reference link][ref%(i)d] and
+an inline [link](http://example.com/%(i)d "title"). More text & <entities>.
+
+- item one with _emphasis_
+- item two with `code`
+
+    def f%(i)d():
+        return %(i)d
+
+> a quote with **bold** text
+
+[ref%(i)d]: http://example.com/ref/%(i)d
+'''
+
+
+def _post(sections):
+    return '\n'.join([_SECTION % dict(i=i) for i in range(sections)])
+
+
+def _time(md, text, n=5):
+    start = time.time()
+    for i in range(n):
+        md.convert(text)
+    return (time.time() - start) / n
+
+
+def main():
+    for sections in (10, 100, 500):
+        text = _post(sections)
+        full = markdown2.Markdown()
+        inc = markdown2.IncrementalMarkdown(block_cache=markdown2.LRUCache())
+        inc.convert(text)
+        edited = text.replace('Some *emphasis*', 'Edited *emphasis*', 1)
+        assert inc.convert(edited) == full.convert(edited)
+        t_full = _time(full, edited)
+        # every run edits the paragraph again, so one block is a cache miss:
+        L = [edited.replace('Edited', 'Edit %d' % i, 1) for i in range(5)]
+        start = time.time()
+        for s in L:
+            inc.convert(s)
+        t_inc = (time.time() - start) / len(L)
+        print '%3d sections, %6d chars: full %.2fms, incremental %.2fms (%.1fx)' % (sections, len(text), t_full * 1e3, t_inc * 1e3, t_full / t_inc)
+
+if __name__ == '__main__':
+    main()
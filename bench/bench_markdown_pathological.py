@@ -0,0 +1,66 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+'''
+Conversion time of pathological markdown inputs at doubling sizes, with the
+growth exponent of the last doubling (1.0 is linear, 2.0 quadratic) and the
+slowest pass. Sizes stop doubling once a conversion takes over 2 seconds.
+
+    python bench/bench_markdown_pathological.py [max_n]
+'''
+
+import os, sys, time, math, logging
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import markdown2
+
+_CORPUS = [
+    ('open brackets', lambda n: '[' * n + 'x'),
+    ('nested brackets', lambda n: '[' * n + 'x' + ']' * n + '(url)'),
+    ('unclosed tags', lambda n: '<div>\n' * n),
+    ('unclosed comment', lambda n: '<!--' + ' x' * n),
+    ('angle brackets', lambda n: '<a ' * n),
+    ('emphasis markers', lambda n: '*a _b ' * n),
+    ('backticks', lambda n: '`a ' * n),
+    ('list items', lambda n: '- item\n' * n),
+    ('nested lists', lambda n: ''.join(['%s- item\n' % ('  ' * (i % 50)) for i in range(n)])),
+    ('nested quotes', lambda n: '>' * n + ' x\n'),
+    ('link references', lambda n: ''.join(['[l%d][r%d] ' % (i, i) for i in range(n)]) + '\n\n' + ''.join(['[r%d]: http://x/%d\n' % (i, i) for i in range(n)])),
+    ('backslashes', lambda n: '\\' * n + '*x*'),
+    ('long line', lambda n: 'word ' * (n * 10)),
+]
+
+
+def _convert(text):
+    '''
+    Seconds to convert text, and the pass with the most exclusive time.
+    '''
+    md = markdown2.Markdown()
+    profiler = markdown2.PassProfiler(md)
+    start = time.time()
+    md.convert(text)
+    t = time.time() - start
+    return t, profiler.slowest()
+
+
+def main(max_n=4000):
+    logging.basicConfig(format='%(name)s: %(message)s')
+    for title, make in _CORPUS:
+        n = 250
+        last = None
+        while n <= max_n:
+            text = make(n)
+            t, slowest = _convert(text)
+            if last and last[0] > 0.001:
+                exponent = math.log(t / last[0]) / math.log(float(len(text)) / last[1])
+            else:
+                exponent = float('nan')
+            last = (t, len(text))
+            if t > 2 or n * 2 > max_n:
+                break
+            n = n * 2
+        print '%-18s %7d chars: %8.1fms, growth ^%.1f, slowest pass %s' % (title, last[1], last[0] * 1000, exponent, slowest)
+
+if __name__ == '__main__':
+    main(*[int(a) for a in sys.argv[1:]])
@@ -0,0 +1,72 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+'''
+Compare the buffered MySQLSocket.recv_plain with the previous reader, which
+read the packet header byte by byte, over a socket pair.
+
+    python bench/bench_network.py [rows] [row_size]
+'''
+
+import os, sys, time, struct, socket, threading
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'vendor'))
+
+from mysql.connector import errors
+from mysql.connector.network import BaseMySQLSocket
+
+
+class _UnbufferedSocket(BaseMySQLSocket):
+    '''
+    The reader before the read-ahead buffer, kept for comparison.
+    '''
+    def recv_plain(self):
+        packet = self.sock.recv(1)
+        while len(packet) < 4:
+            chunk = self.sock.recv(1)
+            if not chunk:
+                raise errors.InterfaceError(errno=2013)
+            packet += chunk
+        self._packet_number = ord(packet[3])
+        packet_totlen = struct.unpack('<I', packet[0:3] + '\x00')[0] + 4
+        rest = packet_totlen - len(packet)
+        while rest > 0:
+            chunk = self.sock.recv(rest)
+            if not chunk:
+                raise errors.InterfaceError(errno=2013)
+            packet += chunk
+            rest = packet_totlen - len(packet)
+        return packet
+    recv = recv_plain
+
+
+def _make_packets(rows, row_size):
+    payload = 'x' * row_size
+    pkt = struct.pack('<I', len(payload))[0:3] + '\x01' + payload
+    return pkt * rows
+
+
+def _run(cls, data, rows):
+    a, b = socket.socketpair()
+    sender = threading.Thread(target=a.sendall, args=(data, ))
+    sender.start()
+    s = cls()
+    s.sock = b
+    start = time.time()
+    for i in xrange(rows):
+        s.recv()
+    t = time.time() - start
+    sender.join()
+    a.close()
+    b.close()
+    return t
+
+
+def main(rows=5000, row_size=80):
+    data = _make_packets(rows, row_size)
+    for name, cls in (('unbuffered', _UnbufferedSocket), ('buffered', BaseMySQLSocket)):
+        t = min([_run(cls, data, rows) for i in range(5)])
+        print '%-12s %6d packets of %4d bytes: %.4fs (%.2fus/packet)' % (name, rows, row_size, t, t * 1e6 / rows)
+
+if __name__ == '__main__':
+    main(*[int(a) for a in sys.argv[1:]])
@@ -0,0 +1,63 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+'''
+Dispatch time of dynamic routes by trying every Route.match() in order, as
+before, against the compiled router, with a few hundred routes registered.
+
+    python bench/bench_router.py [routes]
+'''
+
+import os, sys, time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from lib import web
+
+
+def _routes(n):
+    L = []
+    for i in range(n):
+        fn = web.get('/api/res%d/:id' % i if i % 2 else '/res%d/:id/items/:item_id' % i)(lambda *args: args)
+        L.append(web.Route(fn))
+    L.append(web.StaticFileRoute())
+    return L
+
+
+def _match_linear(routes, path):
+    '''
+    The dispatch before the compiled router, kept for comparison.
+    '''
+    for fn in routes:
+        args = fn.match(path)
+        if args:
+            return fn, args
+    return None
+
+
+def _time(fn, paths, n):
+    start = time.time()
+    for i in xrange(n):
+        for path in paths:
+            fn(path)
+    return (time.time() - start) / n / len(paths)
+
+
+def main(routes=300, n=200):
+    L = _routes(routes)
+    router = web._Router(L)
+    cases = (
+        ('first route', ['/res0/abc/items/1']),
+        ('last route', ['/api/res%d/abc' % (routes - 1 - routes % 2)]),
+        ('static file', ['/static/css/uikit.min.css']),
+        ('not found', ['/no/such/page']),
+    )
+    for name, paths in cases:
+        for path in paths:
+            assert _match_linear(L, path) == router.match(path), path
+        linear = _time(lambda p: _match_linear(L, p), paths, n)
+        compiled = _time(router.match, paths, n)
+        print '%-12s %d routes: linear %7.2fus, compiled %5.2fus (%.1fx)' % (name, routes, linear * 1e6, compiled * 1e6, linear / compiled)
+
+if __name__ == '__main__':
+    main(*[int(a) for a in sys.argv[1:]])
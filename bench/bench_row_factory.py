@@ -0,0 +1,48 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+'''
+Memory and throughput of 10k blog rows built as Dict and copied into a Model,
+as find_by() does by default, against compact Row objects.
+
+    python bench/bench_row_factory.py [rows]
+'''
+
+import os, sys, time, gc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from lib import db
+from models import Blog
+
+_NAMES = ['id', 'name', 'content', 'created_at']
+
+
+def _size(rows):
+    '''
+    Bytes held by the row containers, not counting the shared values.
+    '''
+    total = sys.getsizeof(rows)
+    for r in rows:
+        total += sys.getsizeof(r)
+        if isinstance(r, db.Row):
+            total += sys.getsizeof(r._values)
+    return total
+
+
+def _build(name, fn, values):
+    gc.collect()
+    start = time.time()
+    rows = fn(values)
+    t = time.time() - start
+    print '%-12s %d rows: %.4fs (%.2fus/row), %.1f bytes/row' % (name, len(rows), t, t * 1e6 / len(rows), float(_size(rows)) / len(rows))
+
+
+def main(rows=10000):
+    values = [('%015d' % i, u'blog %d' % i, u'content', 1400000000.0 + i) for i in xrange(rows)]
+    _build('Dict', lambda L: map(db.dict_rows(_NAMES), L), values)
+    _build('Dict+Model', lambda L: [Blog(**d) for d in map(db.dict_rows(_NAMES), L)], values)
+    _build('compact Row', lambda L: map(db.compact_rows(_NAMES), L), values)
+
+if __name__ == '__main__':
+    main(*[int(a) for a in sys.argv[1:]])
@@ -0,0 +1,75 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+'''
+Compare the offset based utils.read_lc_string_list with the previous decoder,
+which truncated the buffer after every column, on synthetic row packets.
+
+    python bench/bench_rows.py
+'''
+
+import os, sys, time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'vendor'))
+
+from mysql.connector import utils
+
+
+def _read_lc_string_list_sliced(buf):
+    '''
+    The decoder before the offset based one, kept for comparison.
+    '''
+    strlst = []
+    while buf:
+        if buf[0] == '\xfb':
+            strlst.append(None)
+            buf = buf[1:]
+            continue
+        l = lsize = 0
+        fst = ord(buf[0])
+        if fst <= 250:
+            l = fst
+            strlst.append(buf[1:l+1])
+            buf = buf[1+l:]
+            continue
+        elif fst == 252:
+            lsize = 2
+        elif fst == 253:
+            lsize = 3
+        if fst == 254:
+            lsize = 8
+        l = utils.intread(buf[1:lsize+1])
+        strlst.append(buf[lsize+1:l+lsize+1])
+        buf = buf[lsize+l+1:]
+    return tuple(strlst)
+
+
+def _make_row(columns, text_size):
+    '''
+    A row with short columns and one TEXT column of text_size bytes every 5 columns.
+    '''
+    L = []
+    for i in range(columns):
+        value = 'c' * (text_size if i % 5 == 4 else 20)
+        L.append(utils.lc_int(len(value)) + value)
+    return ''.join(L)
+
+
+def _time(fn, buf, n):
+    start = time.time()
+    for i in xrange(n):
+        fn(buf)
+    return time.time() - start
+
+
+def main(n=2000):
+    for columns in (5, 20, 100):
+        for text_size in (1024, 65536):
+            buf = _make_row(columns, text_size)
+            assert _read_lc_string_list_sliced(buf) == utils.read_lc_string_list(buf)
+            old = min([_time(_read_lc_string_list_sliced, buf, n) for i in range(3)])
+            new = min([_time(utils.read_lc_string_list, buf, n) for i in range(3)])
+            print '%3d columns, TEXT %6d bytes: sliced %.2fus/row, offset %.2fus/row (%.1fx)' % (columns, text_size, old * 1e6 / n, new * 1e6 / n, old / new)
+
+if __name__ == '__main__':
+    main()
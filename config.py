@@ -34,7 +34,29 @@ def _create_db():
             'database':db,
             },
         'session':{
-            'secret':'YmTx'
+            'secret':'YmTx',
+            # verified cookies kept in memory, for at most cache_ttl seconds. a password change
+            # or deletion drops them in the process making it; other processes keep theirs until the ttl:
+            'cache_size':1024,
+            'cache_ttl':600,
+            },
+        'render':{
+            # rendered html kept in memory, and on disk if cache_dir is set:
+            'cache_size':256,
+            'cache_dir':None,
+            # larger posts, or posts taking longer in seconds, render as escaped text:
+            'max_size':1000000,
+            'time_budget':5.0,
+            # seconds escaped text is cached before the post is rendered again:
+            'fallback_ttl':300,
+            # processes rendering large batches of posts, forked at startup; None for one per CPU, 1 for none:
+            'workers':None,
+            },
+        'response_cache':{
+            # pages of @cached routes kept in memory, or on disk shared by processes if dir is set.
+            # set dir when running several processes: clearing the memory cache only reaches one.
+            'capacity':256,
+            'dir':None,
             }
         }
     return configs
@@ -6,9 +6,7 @@ import time, uuid, functools, threading, logging
 class Dict(dict):
 
     def __init__(self, names=(), values=(), **kw):
-        super(Dict, self).__init__(**kw)
-        for k, v in zip(names, values):
-            self[k] = v
+        super(Dict, self).__init__(zip(names, values), **kw)
 
     def __getattr__(self, key):
         try:
@@ -19,6 +17,73 @@ class Dict(dict):
     def __setattr__(self, key, value):
         self[key] = value
 
+class Row(object):
+    '''
+    Compact read-only row. Rows of one result set share a Row subclass holding
+    the column names, so each row only keeps its values tuple.
+
+    >>> R = compact_rows(('id', 'name'))
+    >>> r = R((1, u'Michael'))
+    >>> r.name, r['id'], r.get('email')
+    (u'Michael', 1, None)
+    >>> dict(r) == dict(id=1, name=u'Michael')
+    True
+    '''
+    __slots__ = ('_values', )
+    _names = ()
+    _index = {}
+
+    def __init__(self, values):
+        self._values = values
+
+    def __getattr__(self, key):
+        try:
+            return self._values[self._index[key]]
+        except KeyError:
+            raise AttributeError(r"'Row' object has no attribute '%s'" % key)
+
+    def __getitem__(self, key):
+        return self._values[self._index[key]]
+
+    def __contains__(self, key):
+        return key in self._index
+
+    def __len__(self):
+        return len(self._names)
+
+    def __iter__(self):
+        return iter(self._names)
+
+    def get(self, key, default=None):
+        i = self._index.get(key)
+        return default if i is None else self._values[i]
+
+    def keys(self):
+        return list(self._names)
+
+    def values(self):
+        return list(self._values)
+
+    def items(self):
+        return zip(self._names, self._values)
+
+    def __repr__(self):
+        return 'Row(%s)' % ', '.join(['%s=%r' % (k, v) for k, v in self.items()])
+
+def dict_rows(names):
+    '''
+    Default row factory: every row becomes a Dict.
+    '''
+    return lambda values: Dict(names, values)
+
+def compact_rows(names):
+    '''
+    Row factory making compact Row objects which share the column names.
+    '''
+    names = tuple(names)
+    index = dict([(n, i) for i, n in enumerate(names)])
+    return type('Row', (Row, ), dict(__slots__=(), _names=names, _index=index))
+
 def next_id(t=None):
     if t is None:
         t = time.time()
@@ -32,15 +97,193 @@ def _profiling(start, sql=''):
         logging.info('[PROFILING] [DB] %s: %s' % (t, sql))
 
 
+class _ConnectionPool(object):
+    '''
+    Bounded, thread-safe pool of db connections.
+
+    At most pool_size idle connections are kept. Up to max_overflow extra
+    connections may be opened under load and are closed on return. A checkout
+    waits up to pool_timeout seconds when the pool is exhausted.
+    '''
+    def __init__(self, connect, pool_size=5, max_overflow=10, pool_timeout=30, idle_timeout=600, max_lifetime=3600, ping=True):
+        self._connect = connect
+        self._pool_size = pool_size
+        self._max_overflow = max_overflow
+        self._pool_timeout = pool_timeout
+        self._idle_timeout = idle_timeout
+        self._max_lifetime = max_lifetime
+        self._ping = ping
+        self._cond = threading.Condition(threading.Lock())
+        # idle connections as [connection, created_at, last_used]:
+        self._idle = []
+        # created_at of every connection currently checked out:
+        self._created = {}
+        self._in_use = 0
+        self._checkouts = 0
+        self._checkout_waits = 0
+        self._checkout_wait_time = 0.0
+
+    def _expired(self, item, now):
+        conn, created_at, last_used = item
+        if self._max_lifetime and now - created_at > self._max_lifetime:
+            return True
+        if self._idle_timeout and now - last_used > self._idle_timeout:
+            return True
+        return False
+
+    def _validate(self, conn):
+        if not self._ping:
+            return True
+        try:
+            conn.ping()
+            return True
+        except Exception, e:
+            logging.warning('[POOL] discard broken connection: %s' % e)
+            return False
+
+    def _close(self, conn):
+        try:
+            conn.close()
+        except Exception, e:
+            logging.warning('[POOL] close connection failed: %s' % e)
+
+    def checkout(self):
+        _start = time.time()
+        waited = False
+        expired = []
+        self._cond.acquire()
+        try:
+            while True:
+                now = time.time()
+                item = None
+                while self._idle and item is None:
+                    item = self._idle.pop()
+                    if self._expired(item, now):
+                        expired.append(item[0])
+                        item = None
+                if item is not None or self._in_use < self._pool_size + self._max_overflow:
+                    self._in_use += 1
+                    break
+                remaining = self._pool_timeout - (now - _start)
+                if remaining <= 0:
+                    raise Exception('connection pool exhausted: %d in use' % self._in_use)
+                waited = True
+                self._cond.wait(remaining)
+            self._checkouts += 1
+            if waited:
+                self._checkout_waits += 1
+                self._checkout_wait_time += time.time() - _start
+        finally:
+            self._cond.release()
+        for conn in expired:
+            self._close(conn)
+        # open or validate the connection outside the lock:
+        try:
+            if item is not None and self._validate(item[0]):
+                conn, created_at = item[0], item[1]
+            else:
+                if item is not None:
+                    self._close(item[0])
+                conn, created_at = self._connect(), time.time()
+        except:
+            self._cond.acquire()
+            try:
+                self._in_use -= 1
+                self._cond.notify()
+            finally:
+                self._cond.release()
+            raise
+        self._created[id(conn)] = created_at
+        return conn
+
+    def checkin(self, conn):
+        created_at = self._created.pop(id(conn), time.time())
+        # end any implicit transaction so the next user gets a fresh snapshot:
+        try:
+            conn.rollback()
+        except Exception, e:
+            logging.warning('[POOL] rollback on checkin failed: %s' % e)
+            conn = None
+        self._cond.acquire()
+        try:
+            self._in_use -= 1
+            if conn is not None and len(self._idle) < self._pool_size:
+                self._idle.append([conn, created_at, time.time()])
+                conn = None
+            self._cond.notify()
+        finally:
+            self._cond.release()
+        if conn is not None:
+            self._close(conn)
+
+    def discard(self, conn):
+        '''
+        Close a checked out connection instead of returning it to the pool,
+        e.g. one left in an unknown state.
+        '''
+        self._created.pop(id(conn), None)
+        self._cond.acquire()
+        try:
+            self._in_use -= 1
+            self._cond.notify()
+        finally:
+            self._cond.release()
+        self._close(conn)
+
+    def dispose(self):
+        self._cond.acquire()
+        try:
+            idle, self._idle = self._idle, []
+        finally:
+            self._cond.release()
+        for item in idle:
+            self._close(item[0])
+
+    @property
+    def stats(self):
+        return Dict(in_use=self._in_use, idle=len(self._idle), checkouts=self._checkouts, checkout_waits=self._checkout_waits, checkout_wait_time=self._checkout_wait_time)
+
+
 class _Engine(object):
 
-    def __init__(self, connect):
+    def __init__(self, connect, cursor=None, stream_cursor=None, **kw):
         self._connect = connect
+        self._cursor = cursor
+        self._stream_cursor = stream_cursor
+        self._pool = _ConnectionPool(connect, **kw)
 
     def connect(self):
-        return self._connect()
+        return self._pool.checkout()
+
+    def cursor(self, connection):
+        if self._cursor:
+            return self._cursor(connection)
+        return connection.cursor()
+
+    def stream_cursor(self, connection):
+        if self._stream_cursor:
+            return self._stream_cursor(connection)
+        return self.cursor(connection)
+
+    def release(self, connection):
+        self._pool.checkin(connection)
+
+    def discard(self, connection):
+        self._pool.discard(connection)
+
+    @property
+    def pool(self):
+        return self._pool
+
+_POOL_ARGS = ('pool_size', 'max_overflow', 'pool_timeout', 'idle_timeout', 'max_lifetime', 'ping')
+
+def _pop_pool_args(kw):
+    return dict([(k, kw.pop(k)) for k in _POOL_ARGS if k in kw])
 
 def create_engine(user, password, database, host='127.0.0.1', port=3306, **kw):
+    pool_kw = _pop_pool_args(kw)
+    # use server-side prepared statements cached per connection:
+    prepared = kw.pop('prepared', True)
     params = dict(user=user, password=password, database=database, host=host, port=port)
     defaults = dict(use_unicode=True, charset='utf8', collation='utf8_general_ci', autocommit=False)
     for k, v in defaults.iteritems():
@@ -49,11 +292,15 @@ def create_engine(user, password, database, host='127.0.0.1', port=3306, **kw):
     params['buffered'] = True
 
     import mysql.connector
-    return _Engine(lambda: mysql.connector.connect(**params))
+    from mysql.connector.cursor import MySQLCursor
+    cursor = (lambda connection: connection.cursor(prepared=True)) if prepared else None
+    stream_cursor = lambda connection: connection.cursor(cursor_class=MySQLCursor)
+    return _Engine(lambda: mysql.connector.connect(**params), cursor=cursor, stream_cursor=stream_cursor, **pool_kw)
 
-def create_engine_MySQLdb(host, user, pw, db, port=3306):
-    import MySQLdb
-    return _Engine(lambda: MySQLdb.connect(host, user, pw, db, port, charset = 'utf8'))
+def create_engine_MySQLdb(host, user, pw, db, port=3306, **kw):
+    import MySQLdb, MySQLdb.cursors
+    stream_cursor = lambda connection: connection.cursor(MySQLdb.cursors.SSCursor)
+    return _Engine(lambda: MySQLdb.connect(host, user, pw, db, port, charset = 'utf8'), stream_cursor=stream_cursor, **kw)
 
 engine = None
 
@@ -64,6 +311,7 @@ class _DbCtx(threading.local):
         self.connection = None
         self.connection_count = 0
         self.transaction_count = 0
+        self.after_commit = []
 
     def init(self):
         if self.connection is None:
@@ -72,15 +320,15 @@ class _DbCtx(threading.local):
             self.transaction_count = 0
 
     def cursor(self):
+        global engine
         if self.connection is None:
             raise Exception('self.connection is None')
         elif self.connection is "init":
-            global engine
             connection = engine.connect()
             self.connection = connection
-            return self.connection.cursor()
+            return engine.cursor(self.connection)
         else:
-            return self.connection.cursor()
+            return engine.cursor(self.connection)
 
     def commit(self):
         if self.connection:
@@ -100,11 +348,13 @@ class _DbCtx(threading.local):
         if self.connection is None:
             raise Exception('self.connetion is None')
         elif self.connection is "init":
-            raise Exception('self.connection is "init"')
+            # no cursor was ever requested, so nothing to release:
+            self.connection = None
         else:
+            global engine
             connection = self.connection
-            connection.close()
             self.connection = None
+            engine.release(connection)
 
 _db_ctx = _DbCtx()
 
@@ -120,12 +370,20 @@ class _ConnectionCtx(object):
     def __exit__(self, exctype, excvalue, traceback):
         global _db_ctx
         _db_ctx.connection_count -= 1
-        if _db_ctx.connection_count == 0:
+        if _db_ctx.connection_count == 0 and _db_ctx.transaction_count == 0:
             _db_ctx.cleanup()
 
 def connection():
     return _ConnectionCtx()
 
+def request_connection():
+    '''
+    Pin one connection for a whole request. It is taken from the pool on the
+    first query, shared by every select/update/transaction inside, and released
+    once when the context exits.
+    '''
+    return _ConnectionCtx()
+
 def with_connection(func):
     @functools.wraps(func)
     def _wrapper(*args, **kw):
@@ -146,15 +404,32 @@ class _TransactionCtx(object):
         global _db_ctx
         _db_ctx.transaction_count -= 1
         if _db_ctx.transaction_count == 0:
+            callbacks, _db_ctx.after_commit = _db_ctx.after_commit, []
             if exctype is None:
                 _db_ctx.commit()
             else:
                 _db_ctx.rollback()
-            _db_ctx.cleanup()
+            if _db_ctx.connection_count == 0:
+                _db_ctx.cleanup()
+            if exctype is None:
+                for fn in callbacks:
+                    fn()
 
 def transaction():
     return _TransactionCtx()
 
+def after_commit(fn):
+    '''
+    Call fn once the current transaction commits, or at once outside a
+    transaction, where every update is committed as it is made. Dropped if
+    the transaction rolls back.
+    '''
+    global _db_ctx
+    if _db_ctx.transaction_count:
+        _db_ctx.after_commit.append(fn)
+    else:
+        fn()
+
 def with_transaction(func):
     @functools.wraps(func)
     def _wrapper(*args, **kw):
@@ -166,7 +441,7 @@ def with_transaction(func):
 
 
 @with_connection
-def _select(sql, first, *args):
+def _select(sql, first, *args, **kw):
     cursor = None
     try:
         global _db_ctx
@@ -177,21 +452,22 @@ def _select(sql, first, *args):
             names = [x[0] for x in cursor.description]
         else:
             raise Exception('cursor.description is None')
+        row = kw.get('row_factory', dict_rows)(names)
         if first:
             value = cursor.fetchone()
             if value:
-                return Dict(names, value)
+                return row(value)
             else:
                 return None
         else:
             values = cursor.fetchall()
-            return [Dict(names, x) for x in values]
+            return map(row, values)
     finally:
         if cursor:
             cursor.close()
 
-def select_one(sql, *args):
-    return _select(sql, True, *args)
+def select_one(sql, *args, **kw):
+    return _select(sql, True, *args, **kw)
 
 def select_int(sql, *args):
     d = _select(sql, True, *args)
@@ -199,8 +475,54 @@ def select_int(sql, *args):
         raise Exception('Expect only one column.')
     return d.values()[0]
 
-def select(sql, *args):
-    return _select(sql, False, *args)
+def select(sql, *args, **kw):
+    '''
+    Execute select SQL and return list of rows. Rows are Dict objects unless
+    another row_factory is given, e.g. row_factory=compact_rows.
+    '''
+    return _select(sql, False, *args, **kw)
+
+def iter_select(sql, *args, **kw):
+    '''
+    Execute select SQL and iterate over the results without loading them all.
+    Rows are fetched batch_size at a time through an unbuffered cursor on a
+    connection of its own, which is held until the generator is exhausted or
+    closed. Closing it early closes the connection rather than reading the
+    rest of the result.
+    '''
+    batch_size = kw.pop('batch_size', 100)
+    row_factory = kw.pop('row_factory', dict_rows)
+    global engine
+    connection = engine.connect()
+    cursor = None
+    pending = False
+    try:
+        cursor = engine.stream_cursor(connection)
+        cursor.execute(sql.replace('?', '%s'), args)
+        pending = True
+        if cursor.description:
+            names = [x[0] for x in cursor.description]
+        else:
+            raise Exception('cursor.description is None')
+        row = row_factory(names)
+        while True:
+            values = cursor.fetchmany(batch_size)
+            if not values:
+                pending = False
+                break
+            for x in values:
+                yield row(x)
+    finally:
+        if pending:
+            # an unread result set blocks the connection, and closing the
+            # cursor would read it all, so drop the connection instead:
+            engine.discard(connection)
+        else:
+            try:
+                if cursor:
+                    cursor.close()
+            finally:
+                engine.release(connection)
 
 
 @with_connection
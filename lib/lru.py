@@ -0,0 +1,74 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+'''
+The bounded in-process cache used by the caches of rendered markdown,
+responses and sessions. The vendored markdown2 keeps its own, so that it
+does not depend on this package.
+'''
+
+import threading
+from collections import OrderedDict
+
+class LRUCache(object):
+    '''
+    Thread-safe, bounded cache that evicts the least recently used entries.
+
+    >>> c = LRUCache(2)
+    >>> c.put('a', 1)
+    []
+    >>> c.put('b', 2)
+    []
+    >>> c.get('a')
+    1
+    >>> c.put('c', 3)
+    [('b', 2)]
+    >>> c.get('b')
+    >>> len(c)
+    2
+    >>> c.pop('a')
+    1
+    >>> c.pop('a')
+    >>> c.clear()
+    >>> len(c)
+    0
+    '''
+    def __init__(self, capacity=256):
+        self.capacity = capacity
+        self._lock = threading.Lock()
+        self._data = OrderedDict()
+
+    def __len__(self):
+        return len(self._data)
+
+    def get(self, key, default=None):
+        with self._lock:
+            value = self._data.pop(key, default)
+            if value is not default:
+                self._data[key] = value
+            return value
+
+    def put(self, key, value):
+        '''
+        Add or replace the value of key, and return the (key, value) pairs
+        evicted to make room for it.
+        '''
+        with self._lock:
+            self._data.pop(key, None)
+            self._data[key] = value
+            evicted = []
+            while len(self._data) > self.capacity:
+                evicted.append(self._data.popitem(last=False))
+            return evicted
+
+    def pop(self, key, default=None):
+        with self._lock:
+            return self._data.pop(key, default)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+if __name__=='__main__':
+    import doctest
+    doctest.testmod()
@@ -1,7 +1,7 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
 
-import time, logging
+import time, json, base64, threading, logging
 
 import db
 
@@ -17,6 +17,7 @@ class Field(object):
         self.updatable = kw.get('updatable', True)
         self.insertable = kw.get('insertable', True)
         self.ddl = kw.get('ddl', '')
+        self.index = kw.get('index', False)
         self._order = Field._count
         Field._count = Field._count + 1
 
@@ -92,10 +93,11 @@ class VersionField(Field):
     def __init__(self, name=None):
         super(VersionField, self).__init__(name=name, default=0, ddl='bigint')
 
-_triggers = frozenset(['pre_insert', 'pre_update', 'pre_delete'])
+_triggers = frozenset(['pre_insert', 'pre_update', 'pre_delete', 'post_insert', 'post_update', 'post_delete'])
 
 def _gen_sql(table_name, mappings):
     pk = None
+    keys = []
     sql = ['create table if not exists `%s` (' % table_name]
     for f in sorted(mappings.values(), lambda x, y: cmp(x._order, y._order)):
         if not hasattr(f, 'ddl'):
@@ -104,11 +106,113 @@ def _gen_sql(table_name, mappings):
         nullable = f.nullable
         if f.primary_key:
             pk = f.name
+        elif f.index:
+            keys.append(',\n  key `idx_%s` (`%s`)' % (f.name, f.name))
         sql.append(nullable and '  `%s` %s,' % (f.name, ddl) or '  `%s` %s not null,' % (f.name, ddl))
-    sql.append('  primary key(`%s`)' % pk)
+    sql.append('  primary key(`%s`)%s' % (pk, ''.join(keys)))
     sql.append(');')
     return '\n'.join(sql)
 
+def _encode_cursor(values):
+    return base64.urlsafe_b64encode(json.dumps(values, separators=(',', ':')))
+
+def _decode_cursor(cursor):
+    '''
+    Decode an opaque page cursor made by _encode_cursor. Raise ValueError if invalid.
+
+    >>> _decode_cursor(_encode_cursor([1400000000.25, u'0014']))
+    [1400000000.25, u'0014']
+    >>> _decode_cursor('x')
+    Traceback (most recent call last):
+      ...
+    ValueError: invalid cursor: 'x'
+    '''
+    try:
+        values = json.loads(base64.urlsafe_b64decode(str(cursor)))
+    except (TypeError, ValueError, UnicodeError):
+        values = None
+    if not isinstance(values, list) or len(values) != 2:
+        raise ValueError('invalid cursor: %r' % cursor)
+    return values
+
+class _CountCache(object):
+    '''
+    Thread-safe cache of row counts keyed by (table, where, args). Entries
+    expire after ttl seconds and are dropped by Model.insert(), update() and
+    delete() on the same table. At most max_size entries are kept: when full,
+    expired entries are dropped, then the oldest. Set ttl to 0 to disable.
+
+    >>> c = _CountCache(ttl=60, max_size=2)
+    >>> c.get('blog', '', ())
+    >>> c.put('blog', '', (), 10)
+    >>> c.get('blog', '', ())
+    10
+    >>> c.put('blog', 'where id=?', (1, ), 1)
+    >>> c.put('blog', 'where id=?', (2, ), 1)
+    >>> c.get('blog', '', ()), len(c)
+    (None, 2)
+    >>> c.invalidate('blog')
+    >>> c.get('blog', 'where id=?', (2, ))
+    '''
+    def __init__(self, ttl=60, max_size=1000):
+        self.ttl = ttl
+        self.max_size = max_size
+        self._size = 0
+        self._lock = threading.Lock()
+        # table => {(where, args): (count, expires)}
+        self._tables = {}
+
+    def get(self, table, where, args):
+        if not self.ttl:
+            return None
+        with self._lock:
+            entry = self._tables.get(table, {}).get((where, args))
+        if entry and entry[1] > time.time():
+            return entry[0]
+        return None
+
+    def put(self, table, where, args, count):
+        if not self.ttl:
+            return
+        now = time.time()
+        with self._lock:
+            entries = self._tables.setdefault(table, {})
+            if (where, args) not in entries:
+                if self._size >= self.max_size:
+                    self._evict(now)
+                self._size += 1
+            entries[(where, args)] = (count, now + self.ttl)
+
+    def _evict(self, now):
+        '''
+        Drop the expired entries, or if there are none, the one expiring first.
+        '''
+        oldest = None
+        for table, entries in self._tables.items():
+            for key, (count, expires) in entries.items():
+                if expires <= now:
+                    del entries[key]
+                    self._size -= 1
+                elif oldest is None or expires < oldest[0]:
+                    oldest = (expires, table, key)
+        if self._size >= self.max_size and oldest:
+            del self._tables[oldest[1]][oldest[2]]
+            self._size -= 1
+
+    def invalidate(self, table):
+        with self._lock:
+            self._size -= len(self._tables.pop(table, ()))
+
+    def clear(self):
+        with self._lock:
+            self._tables.clear()
+            self._size = 0
+
+    def __len__(self):
+        return self._size
+
+count_cache = _CountCache()
+
 class ModelMetaclass(type):
     '''
     Metaclass for model objects.
@@ -248,34 +352,96 @@ class Model(dict):
         return cls(**d) if d else None
 
     @classmethod
-    def find_all(cls, *args):
+    def find_all(cls, *args, **kw):
+        '''
+        Find all and return list. If row_factory is given, e.g. db.compact_rows,
+        the rows it makes are returned instead of model instances.
+        '''
+        L = db.select('select * from `%s`' % cls.__table__, **kw)
+        return L if 'row_factory' in kw else [cls(**d) for d in L]
+
+    @classmethod
+    def find_by(cls, where, *args, **kw):
+        '''
+        Find by where clause and return list. If row_factory is given, e.g.
+        db.compact_rows, the rows it makes are returned instead of model instances.
+        '''
+        L = db.select('select * from `%s` %s' % (cls.__table__, where), *args, **kw)
+        return L if 'row_factory' in kw else [cls(**d) for d in L]
+
+    @classmethod
+    def iter_by(cls, where, *args, **kw):
+        '''
+        Find by where clause and iterate over results, fetching batch_size rows
+        at a time so memory stays flat regardless of table size. Accepts
+        row_factory like find_by().
+        '''
+        L = db.iter_select('select * from `%s` %s' % (cls.__table__, where), *args, **kw)
+        try:
+            for d in L:
+                yield d if 'row_factory' in kw else cls(**d)
+        finally:
+            L.close()
+
+    @classmethod
+    def find_page(cls, order_by='created_at', after=None, before=None, size=15, desc=True):
         '''
-        Find all and return list.
+        Find one page by keyset (seek) pagination on (order_by, pk) and return
+        (list, next_cursor, previous_cursor). Pass the next cursor as after, or
+        the previous cursor as before, to get the adjacent page. A cursor is None
+        if there is no such page. Unlike limit ?,? this does not scan the skipped
+        rows, so order_by should be an indexed field. Raise ValueError if the
+        cursor is invalid.
         '''
-        L = db.select('select * from `%s`' % cls.__table__)
-        return [cls(**d) for d in L]
+        pk = cls.__primary_key__.name
+        reverse = before is not None
+        cursor = before if reverse else after
+        # walking backwards is a forward walk in the opposite order:
+        op, order = ('<', 'desc') if desc != reverse else ('>', 'asc')
+        where, args = '', []
+        if cursor is not None:
+            value, key = _decode_cursor(cursor)
+            where = 'where `%s`%s? or (`%s`=? and `%s`%s?)' % (order_by, op, order_by, pk, op)
+            args = [value, value, key]
+        args.append(size + 1)
+        L = cls.find_by('%s order by `%s` %s, `%s` %s limit ?' % (where, order_by, order, pk, order), *args)
+        more = len(L) > size
+        L = L[:size]
+        if reverse:
+            L.reverse()
+        if not L:
+            return L, None, None
+        first, last = cls.cursor_of(L[0], order_by), cls.cursor_of(L[-1], order_by)
+        if reverse:
+            return L, last, first if more else None
+        return L, last if more else None, first if after is not None else None
 
     @classmethod
-    def find_by(cls, where, *args):
+    def cursor_of(cls, obj, order_by='created_at'):
         '''
-        Find by where clause and return list.
+        Make the opaque cursor of a row for find_page().
         '''
-        L = db.select('select * from `%s` %s' % (cls.__table__, where), *args)
-        return [cls(**d) for d in L]
+        return _encode_cursor([obj[order_by], obj[cls.__primary_key__.name]])
 
     @classmethod
     def count_all(cls):
         '''
-        Find by 'select count(pk) from table' and return integer.
+        Find by 'select count(pk) from table' and return integer. The result is
+        cached in count_cache.
         '''
-        return db.select_int('select count(`%s`) from `%s`' % (cls.__primary_key__.name, cls.__table__))
+        return cls.count_by('')
 
     @classmethod
     def count_by(cls, where, *args):
         '''
-        Find by 'select count(pk) from table where ... ' and return int.
+        Find by 'select count(pk) from table where ... ' and return int. The
+        result is cached in count_cache.
         '''
-        return db.select_int('select count(`%s`) from `%s` %s' % (cls.__primary_key__.name, cls.__table__, where), *args)
+        n = count_cache.get(cls.__table__, where, args)
+        if n is None:
+            n = db.select_int('select count(`%s`) from `%s` %s' % (cls.__primary_key__.name, cls.__table__, where), *args)
+            count_cache.put(cls.__table__, where, args, n)
+        return n
 
     def update(self):
         self.pre_update and self.pre_update()
@@ -293,6 +459,8 @@ class Model(dict):
         pk = self.__primary_key__.name
         args.append(getattr(self, pk))
         db.update('update `%s` set %s where %s=?' % (self.__table__, ','.join(L), pk), *args)
+        count_cache.invalidate(self.__table__)
+        self.post_update and self.post_update()
         return self
 
     def delete(self):
@@ -300,6 +468,8 @@ class Model(dict):
         pk = self.__primary_key__.name
         args = (getattr(self, pk), )
         db.update('delete from `%s` where `%s`=?' % (self.__table__, pk), *args)
+        count_cache.invalidate(self.__table__)
+        self.post_delete and self.post_delete()
         return self
 
     def insert(self):
@@ -311,6 +481,8 @@ class Model(dict):
                     setattr(self, k, v.default)
                 params[v.name] = getattr(self, k)
         db.insert('%s' % self.__table__, **params)
+        count_cache.invalidate(self.__table__)
+        self.post_insert and self.post_insert()
         return self
 
 if __name__=='__main__':
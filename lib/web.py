@@ -1,13 +1,21 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
 
-import types, os, re, cgi, sys, time, datetime, functools, mimetypes, threading, logging, urllib, traceback
+import types, os, re, cgi, sys, stat, time, datetime, functools, mimetypes, threading, logging, urllib, traceback, hashlib, tempfile, zlib
+import email.utils
+
+try:
+    import cPickle as pickle
+except ImportError:
+    import pickle
 
 try:
     from cStringIO import StringIO
 except ImportError:
     from StringIO import StringIO
 
+from lru import LRUCache
+
 # thread local object for storing request and response:
 ctx = threading.local()
 
@@ -333,6 +341,237 @@ class Template(object):
         self.model = dict(**kw)
 
 
+# 响应缓存
+def cached(ttl=60, vary=(), params=()):
+    '''
+    Cache the whole response of a GET route for anonymous requests, that is
+    requests without ctx.request.user, in the response_cache of the
+    application. Responses are keyed by path, the query parameters named in
+    params and the request headers named in vary, so other parameters do not
+    make new entries; name every parameter the route reads. Entries are kept
+    ttl seconds or until the cache is cleared. Only 200 responses without
+    cookies are stored.
+
+    @view('blogs.html')
+    @get('/blogs')
+    @cached(ttl=60, params=('page', ))
+    def blogs():
+        ...
+    '''
+    def _decorator(func):
+        func.__web_cache__ = (ttl, tuple(vary), tuple(params))
+        return func
+    return _decorator
+
+
+class _CachedResponse(object):
+
+    def __init__(self, status, headers, body, compressed=None):
+        self.status = status
+        self.headers = headers
+        self.body = body
+        # the body gzipped once when stored, if it is compressible:
+        self.compressed = compressed
+
+
+def _build_cached_fn(fn, cache, ttl, vary, params):
+    def _wrapper(*args):
+        request = ctx.request
+        if getattr(request, 'user', None) is not None:
+            return fn(*args)
+        key = '\n'.join([request.path_info] + [_to_str(request.get(p, '')) for p in params] + [request.header(h, '') for h in vary])
+        entry = cache.get(key)
+        if entry:
+            return _CachedResponse(*entry)
+        # taken before the handler reads anything, so a page built from data
+        # older than a clear() is not stored after it:
+        request._response_cache = (key, ttl, cache.generation())
+        return fn(*args)
+    return _wrapper
+
+
+class MemoryResponseCache(object):
+    '''
+    Response cache backend: a thread-safe in-process LRU. Each process has its
+    own, and clear() only empties that of the calling process, so when the
+    application runs in several processes the others keep serving a changed
+    page until its ttl runs out. Use DiskResponseCache there.
+
+    >>> c = MemoryResponseCache(2)
+    >>> c.put('a', ('200 OK', [], 'A'), 60)
+    >>> c.put('b', ('200 OK', [], 'B'), 60)
+    >>> c.get('a')
+    ('200 OK', [], 'A')
+    >>> c.put('c', ('200 OK', [], 'C'), 60)
+    >>> c.get('b')
+    >>> c.put('d', ('200 OK', [], 'D'), -1)
+    >>> c.get('d')
+    >>> g = c.generation()
+    >>> c.clear()
+    >>> c.get('a')
+    >>> c.put('a', ('200 OK', [], 'A'), 60, g)
+    >>> c.get('a')
+    '''
+    def __init__(self, capacity=256):
+        self._lru = LRUCache(capacity)
+        self._generation = 0
+
+    def get(self, key):
+        entry = self._lru.get(key)
+        if entry is None:
+            return None
+        if entry[0] < time.time():
+            self._lru.pop(key)
+            return None
+        return entry[1]
+
+    def generation(self):
+        '''
+        Changed by every clear().
+        '''
+        return self._generation
+
+    def put(self, key, value, ttl, generation=None):
+        '''
+        Store value for ttl seconds, unless the cache was cleared since
+        generation was taken.
+        '''
+        if generation is None or generation==self._generation:
+            self._lru.put(key, (time.time() + ttl, value))
+
+    def clear(self):
+        self._generation = self._generation + 1
+        self._lru.clear()
+
+
+class DiskResponseCache(object):
+    '''
+    Response cache backend: pickled files under directory, shared by all the
+    processes using it, so clear() in one process invalidates all of them.
+    Writes are atomic renames. A file's mtime is its expiry time, and every
+    capacity / 4 writes expired files are removed, then the files expiring
+    first until at most capacity are left.
+
+    >>> import shutil
+    >>> d = tempfile.mkdtemp()
+    >>> c = DiskResponseCache(d, 8)
+    >>> c.put('a', ('200 OK', [], 'A'), 60)
+    >>> DiskResponseCache(d).get('a')
+    ('200 OK', [], 'A')
+    >>> c.put('b', ('200 OK', [], 'B'), -1)
+    >>> c.get('b')
+    >>> for i in range(20):
+    ...     c.put(str(i), ('200 OK', [], str(i)), 60 + i)
+    >>> len(os.listdir(d)) <= 8 + 2
+    True
+    >>> c.get('19')
+    ('200 OK', [], '19')
+    >>> g = c.generation()
+    >>> c.clear()
+    >>> c.get('19')
+    >>> c.put('19', ('200 OK', [], '19'), 60, g)
+    >>> c.get('19')
+    >>> shutil.rmtree(d)
+    '''
+    def __init__(self, directory, capacity=1024):
+        self.directory = directory
+        self.capacity = capacity
+        self._puts = 0
+
+    def _path(self, key):
+        return os.path.join(self.directory, hashlib.sha1(key).hexdigest() + '.cache')
+
+    def get(self, key):
+        try:
+            with open(self._path(key), 'rb') as f:
+                expires, k, value = pickle.load(f)
+        except (IOError, EOFError, pickle.UnpicklingError):
+            return None
+        if k != key or expires < time.time():
+            return None
+        return value
+
+    def generation(self):
+        '''
+        The mtime of the marker file touched by every clear(), in any process.
+        '''
+        try:
+            return os.stat(os.path.join(self.directory, 'cleared')).st_mtime
+        except OSError:
+            return 0
+
+    def put(self, key, value, ttl, generation=None):
+        '''
+        Store value for ttl seconds, unless the cache was cleared since
+        generation was taken.
+        '''
+        if generation is not None and generation!=self.generation():
+            return
+        try:
+            if not os.path.isdir(self.directory):
+                os.makedirs(self.directory)
+            expires = time.time() + ttl
+            fd, tmp = tempfile.mkstemp(dir=self.directory)
+            with os.fdopen(fd, 'wb') as f:
+                pickle.dump((expires, key, value), f, pickle.HIGHEST_PROTOCOL)
+            os.utime(tmp, (expires, expires))
+            os.rename(tmp, self._path(key))
+        except (IOError, OSError), e:
+            logging.warning('cannot write response cache: %s' % e)
+        self._puts = self._puts + 1
+        if self._puts * 4 >= self.capacity:
+            self._puts = 0
+            self.sweep()
+
+    def sweep(self):
+        '''
+        Remove expired files, then the files expiring first while there are
+        more than capacity.
+        '''
+        now = time.time()
+        L = []
+        for path in self._files():
+            try:
+                expires = os.stat(path).st_mtime
+            except OSError:
+                continue
+            if expires < now:
+                self._remove(path)
+            else:
+                L.append((expires, path))
+        if len(L) > self.capacity:
+            L.sort()
+            for expires, path in L[:len(L) - self.capacity]:
+                self._remove(path)
+
+    def clear(self):
+        marker = os.path.join(self.directory, 'cleared')
+        # mtimes can be too coarse to tell two clears apart:
+        mtime = max(time.time(), self.generation() + 1)
+        try:
+            if not os.path.isdir(self.directory):
+                os.makedirs(self.directory)
+            open(marker, 'ab').close()
+            os.utime(marker, (mtime, mtime))
+        except (IOError, OSError), e:
+            logging.warning('cannot mark response cache cleared: %s' % e)
+        for path in self._files():
+            self._remove(path)
+
+    def _files(self):
+        try:
+            names = os.listdir(self.directory)
+        except OSError:
+            return []
+        return [os.path.join(self.directory, name) for name in names if name.endswith('.cache')]
+
+    def _remove(self, path):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+
 # 拦截器
 def interceptor(pattern='/'):
     def _decorator(func):
@@ -345,16 +584,61 @@ def _build_pattern_fn(pattern):
     _RE_INTERCEPTROR_STARTS_WITH = re.compile(r'^([^\*\?]+)\*?$')
     start = _RE_INTERCEPTROR_STARTS_WITH.match(pattern)
     if start:
-        return lambda p: p.startswith(start.group(1))
+        return _PathPattern(prefix=start.group(1))
     else:
         _RE_INTERCEPTROR_ENDS_WITH = re.compile(r'^\*([^\*\?]+)$')
         end = _RE_INTERCEPTROR_ENDS_WITH.match(pattern)
         if end:
-            return lambda p: p.endswith(end.group(1))
+            return _PathPattern(suffix=end.group(1))
         else:
             raise ValueError('Invalid pattern definition in interceptor.')
 
 
+class _PathPattern(object):
+    '''
+    Interceptor pattern matching paths by prefix or by suffix.
+
+    >>> p = _PathPattern(prefix='/manage/')
+    >>> p('/manage/blogs'), p('/api/blogs')
+    (True, False)
+    >>> route = lambda path: Route(get(path)(lambda *args: None))
+    >>> p.applies(route('/manage/blogs/edit/:blog_id'))
+    True
+    >>> p.applies(route('/api/blogs/:blog_id'))
+    False
+    >>> p.applies(route('/:page')) is None
+    True
+    >>> _PathPattern(suffix='.html').applies(route('/:page.html'))
+    True
+    '''
+    def __init__(self, prefix=None, suffix=None):
+        self.prefix = prefix
+        self.suffix = suffix
+
+    def __call__(self, path):
+        if self.prefix is not None:
+            return path.startswith(self.prefix)
+        return path.endswith(self.suffix)
+
+    def applies(self, route):
+        '''
+        Whether the pattern matches all paths of route (True), none (False),
+        or depends on the values of the route variables (None).
+        '''
+        if route.route is None:
+            return self(route.path)
+        parts = _RE_ROUTE_VAR.split(route.path)
+        if self.prefix is not None:
+            fixed, pattern = parts[0], self.prefix
+            if fixed.startswith(pattern):
+                return True
+            return None if pattern.startswith(fixed) else False
+        fixed, pattern = parts[-1], self.suffix
+        if fixed.endswith(pattern):
+            return True
+        return None if pattern.endswith(fixed) else False
+
+
 def _build_interceptor_chain(last_fn, *interceptors):
     '''
     >>> def target():
@@ -411,6 +695,58 @@ def _build_interceptor_fn(func, next):
             return next()
     return _wrapper
 
+def _build_route_chain(route, interceptors, last_fn=None):
+    '''
+    Chain of the interceptors applying to route, calling last_fn(*args), by
+    default route(*args), last.
+    Which interceptors apply is resolved once from the route path, so only an
+    interceptor depending on the value of a route variable checks the path of
+    each request.
+
+    >>> @interceptor('/')
+    ... def f1(next):
+    ...     print 'before f1()'
+    ...     return next()
+    >>> @interceptor('/manage/')
+    ... def f2(next):
+    ...     print 'before f2()'
+    ...     return next()
+    >>> @interceptor('/a')
+    ... def f3(next):
+    ...     print 'before f3()'
+    ...     return next()
+    >>> @get('/:page/edit')
+    ... def target(page):
+    ...     return page
+    >>> chain = _build_route_chain(Route(target), [f1, f2, f3])
+    >>> ctx.request = Dict(path_info='/about/edit')
+    >>> chain('about')
+    before f1()
+    before f3()
+    'about'
+    >>> ctx.request = Dict(path_info='/blog/edit')
+    >>> chain('blog')
+    before f1()
+    'blog'
+    '''
+    fn = last_fn or route
+    for f in reversed(interceptors):
+        applies = f.__interceptor__.applies(route)
+        if applies is not False:
+            fn = _link_interceptor_fn(f, fn, applies)
+    return fn
+
+def _link_interceptor_fn(func, next, always):
+    if always:
+        def _wrapper(*args):
+            return func(functools.partial(next, *args))
+    else:
+        def _wrapper(*args):
+            if func.__interceptor__(ctx.request.path_info):
+                return func(functools.partial(next, *args))
+            return next(*args)
+    return _wrapper
+
 
 class MultipartFile(object):
     '''
@@ -585,7 +921,9 @@ class Request(object):
 
     @property
     def path_info(self):
-        return urllib.unquote(self._environ.get('PATH_INFO', ''))
+        if not hasattr(self, '_path_info'):
+            self._path_info = urllib.unquote(self._environ.get('PATH_INFO', ''))
+        return self._path_info
 
     @property
     def host(self):
@@ -685,6 +1023,38 @@ class Response(object):
     def content_length(self, value):
         self.set_header('CONTENT-LENGTH', str(value))
 
+    @property
+    def etag(self):
+        return self.header('ETAG')
+
+    @etag.setter
+    def etag(self, value):
+        '''
+        Set the ETag from an unquoted value.
+
+        >>> r = Response()
+        >>> r.etag = '5f-1342274794'
+        >>> r.etag
+        '"5f-1342274794"'
+        '''
+        self.set_header('ETAG', '"%s"' % value)
+
+    @property
+    def last_modified(self):
+        return self.header('LAST-MODIFIED')
+
+    @last_modified.setter
+    def last_modified(self, value):
+        '''
+        Set Last-Modified from a unix timestamp.
+
+        >>> r = Response()
+        >>> r.last_modified = 1342274794.123
+        >>> r.last_modified
+        'Sat, 14 Jul 2012 14:06:34 GMT'
+        '''
+        self.set_header('LAST-MODIFIED', email.utils.formatdate(value, usegmt=True))
+
     def set_cookie(self, name, value, max_age=None, expires=None, path='/', domain=None, secure=False, http_only=True):
         '''
         Set a cookie.
@@ -774,14 +1144,16 @@ class Response(object):
 
 
 # 路由
+_RE_ROUTE_VAR = re.compile(r'(\:[a-zA-Z_]\w*)')
+_RE_ROUTE_SEGMENT_VAR = re.compile(r'^\:[a-zA-Z_]\w*$')
+
 class Route(object):
 
     def __init__(self, func):
         self.func = func
         self.path = func.__web_route__
         self.method = func.__web_method__
-        _re_route = re.compile(r'(\:[a-zA-Z_]\w*)')
-        dyn =  _re_route.search(self.path)
+        dyn =  _RE_ROUTE_VAR.search(self.path)
         if dyn:
             self.route = re.compile(_build_regex(self.path))
         else:
@@ -821,8 +1193,7 @@ def _build_regex(path):
     re_list = ['^']
     var_list = []
     is_var = False
-    _re_route = re.compile(r'(\:[a-zA-Z_]\w*)')
-    for v in _re_route.split(path):
+    for v in _RE_ROUTE_VAR.split(path):
         if is_var:
             var_name = v[1:]
             var_list.append(var_name)
@@ -844,11 +1215,157 @@ def _build_regex(path):
     return ''.join(re_list)
 
 
-class StaticFileRoute(object):
+class _RouteNode(object):
+
+    __slots__ = ('static', 'variable', 'patterns', 'route')
 
     def __init__(self):
+        self.static = {}
+        self.variable = None
+        self.patterns = []
+        self.route = None
+
+
+class _Router(object):
+    '''
+    Compiled dispatch of dynamic routes: a trie of path segments, so matching
+    costs O(segments) whatever the number of routes. A segment is matched by
+    its text, by a variable taking the whole segment, or by a per-segment
+    regex such as ':id-:pid'. Routes with a prefix attribute, like
+    StaticFileRoute, take any path starting with it. If several routes match,
+    the first added wins, as with trying Route.match() in order.
+
+    >>> r1 = Route(get('/blog/:id')(lambda id: id))
+    >>> r2 = Route(get('/:id-:pid/:w')(lambda id, pid, w: w))
+    >>> r3 = Route(get('/blog/:id/:w')(lambda id, w: w))
+    >>> r4 = Route(get('/user/u:id')(lambda id: id))
+    >>> router = _Router([r1, r2, r3, r4])
+    >>> router.match('/blog/123') == (r1, ('123', ))
+    True
+    >>> router.match('/a-b/c') == (r2, ('a', 'b', 'c'))
+    True
+    >>> router.match('/blog/1-2') == (r1, ('1-2', ))
+    True
+    >>> router.match('/blog/a-b') == (r1, ('a-b', ))
+    True
+    >>> router.match('/blog/') is None
+    True
+    >>> router.match('/blog/123/comments/') is None
+    True
+    >>> router.match('/user/u42') == (r4, ('42', ))
+    True
+    >>> router.match('/user/42') is None
+    True
+    '''
+    def __init__(self, routes):
+        self._root = _RouteNode()
+        self._prefixes = []
+        for index, route in enumerate(routes):
+            prefix = getattr(route, 'prefix', None)
+            if prefix:
+                self._prefixes.append((index, route))
+            else:
+                self._add(index, route)
+
+    def _add(self, index, route):
+        node = self._root
+        for segment in route.path.split('/'):
+            if not ':' in segment:
+                node = node.static.setdefault(segment, _RouteNode())
+            elif _RE_ROUTE_SEGMENT_VAR.match(segment):
+                if node.variable is None:
+                    node.variable = _RouteNode()
+                node = node.variable
+            else:
+                regex = _build_regex(segment)
+                for r, child in node.patterns:
+                    if r.pattern==regex:
+                        node = child
+                        break
+                else:
+                    child = _RouteNode()
+                    node.patterns.append((re.compile(regex), child))
+                    node = child
+        if node.route is None:
+            node.route = (index, route)
+
+    def match(self, path):
+        '''
+        Return (route, args) of the route matching path, or None.
+        '''
+        segments = path.split('/')
+        n = len(segments)
+        best = None
+        stack = [(self._root, 0, ())]
+        while stack:
+            node, i, args = stack.pop()
+            if i==n:
+                if node.route and (best is None or node.route[0] < best[0]):
+                    best = node.route + (args, )
+                continue
+            segment = segments[i]
+            child = node.static.get(segment)
+            if child:
+                stack.append((child, i + 1, args))
+            if segment:
+                if node.variable:
+                    stack.append((node.variable, i + 1, args + (segment, )))
+                for regex, child in node.patterns:
+                    m = regex.match(segment)
+                    if m:
+                        stack.append((child, i + 1, args + m.groups()))
+        for index, route in self._prefixes:
+            if best is not None and best[0] < index:
+                break
+            if path.startswith(route.prefix):
+                args = route.match(path)
+                if args:
+                    best = (index, route, args)
+                    break
+        return best and best[1:]
+
+
+# name.0123abcd.ext, or its name.0123abcd.ext.gz, whose content never changes:
+_RE_FINGERPRINTED = re.compile(r'\.[0-9a-f]{8,}\.\w+(\.gz)?$')
+
+class _StaticFile(object):
+
+    __slots__ = ('path', 'size', 'content_type', 'etag', 'last_modified', 'cache_control', 'checked_at', 'gzip')
+
+    def __init__(self, path, st, checked_at, gzip=None):
+        self.path = path
+        self.size = st.st_size
+        self.content_type = mimetypes.types_map.get(os.path.splitext(path)[1].lower(), 'application/octet-stream')
+        self.etag = '"%x-%x"' % (int(st.st_mtime), st.st_size)
+        self.last_modified = email.utils.formatdate(st.st_mtime, usegmt=True)
+        if _RE_FINGERPRINTED.search(path):
+            self.cache_control = 'public, max-age=31536000'
+        else:
+            self.cache_control = 'no-cache'
+        self.checked_at = checked_at
+        # the precompressed path.gz, if any:
+        self.gzip = gzip
+
+
+class StaticFileRoute(object):
+    '''
+    Files under document_root/static. The stat and mime type of a file are
+    looked up once and rechecked every check_interval seconds. Full files are
+    returned through wsgi.file_wrapper if the server has one, so it can use
+    sendfile(); a single byte Range is answered 206. If path.gz exists, it is
+    sent instead to clients accepting gzip. Fingerprinted names like
+    app.0123abcd.js are cached by clients for a year, other files revalidate
+    by ETag every time.
+    '''
+    prefix = '/static/'
+
+    def __init__(self, check_interval=0):
         self.method = 'GET'
+        # for _PathPattern.applies(); the file may span several segments:
+        self.path = '/static/:file'
         self.route = re.compile('^/static/(.+)$')
+        self.check_interval = check_interval
+        self._files = {}
 
     def match(self, url):
         if url.startswith('/static/'):
@@ -856,26 +1373,309 @@ class StaticFileRoute(object):
         else:
             return None
 
+    def _lookup(self, fpath):
+        now = time.time()
+        f = self._files.get(fpath)
+        if f and now - f.checked_at < self.check_interval:
+            return f
+        st = _stat_file(fpath)
+        if st is None:
+            self._files.pop(fpath, None)
+            return None
+        gz = _stat_file(fpath + '.gz')
+        if gz is not None:
+            gz = _StaticFile(fpath + '.gz', gz, now)
+        f = self._files[fpath] = _StaticFile(fpath, st, now, gz)
+        return f
+
     def __call__(self, *args):
-        fpath = os.path.join(ctx.application.document_root, args[0])
-        if not os.path.isfile(fpath):
+        root = os.path.join(ctx.application.document_root, 'static')
+        fpath = os.path.normpath(os.path.join(ctx.application.document_root, args[0]))
+        if not fpath.startswith(root + os.sep):
+            raise notfound()
+        f = self._lookup(fpath)
+        if f is None:
             raise notfound()
-        fext = os.path.splitext(fpath)[1]
-        ctx.response.content_type = mimetypes.types_map.get(fext.lower(), 'application/octet-stream')
-        return _static_file_generator(fpath)
+        request, response = ctx.request, ctx.response
+        response.content_type = f.content_type
+        if f.gzip:
+            response.set_header('Vary', 'Accept-Encoding')
+            if _accepts_gzip(request.header('ACCEPT-ENCODING')):
+                f = f.gzip
+                response.set_header('Content-Encoding', 'gzip')
+        response.set_header('ETag', f.etag)
+        response.set_header('Last-Modified', f.last_modified)
+        response.set_header('Cache-Control', f.cache_control)
+        response.set_header('Accept-Ranges', 'bytes')
+        if _not_modified(request, [('ETag', f.etag), ('Last-Modified', f.last_modified)]):
+            # with the headers of the 200, which wsgi() drops the body ones of:
+            response.status = 304
+            response.content_length = f.size
+            return []
+        byte_range = None
+        if_range = request.header('IF-RANGE')
+        if if_range is None or if_range in (f.etag, f.last_modified):
+            byte_range = _parse_range(request.header('RANGE'), f.size)
+        if byte_range is False:
+            response.status = 416
+            response.set_header('Content-Range', 'bytes */%d' % f.size)
+            return []
+        if byte_range:
+            start, end = byte_range
+            response.status = 206
+            response.set_header('Content-Range', 'bytes %d-%d/%d' % (start, end, f.size))
+            response.content_length = end - start + 1
+            return _static_file_generator(f.path, start, end - start + 1)
+        response.content_length = f.size
+        file_wrapper = request._environ.get('wsgi.file_wrapper')
+        if file_wrapper:
+            return file_wrapper(open(f.path, 'rb'), _BLOCK_SIZE)
+        return _static_file_generator(f.path)
+
+
+def _stat_file(fpath):
+    try:
+        st = os.stat(fpath)
+    except OSError:
+        return None
+    return st if stat.S_ISREG(st.st_mode) else None
+
+
+def _accepts_gzip(accept_encoding):
+    '''
+    Whether an Accept-Encoding header value allows gzip.
+
+    >>> _accepts_gzip('gzip, deflate')
+    True
+    >>> _accepts_gzip('deflate, gzip;q=0')
+    False
+    >>> _accepts_gzip('*')
+    True
+    >>> _accepts_gzip(None)
+    False
+    '''
+    if not accept_encoding:
+        return False
+    allowed = None
+    for item in accept_encoding.split(','):
+        params = item.split(';')
+        coding = params[0].strip().lower()
+        if coding in ('gzip', 'x-gzip', '*'):
+            q = 1.0
+            for p in params[1:]:
+                p = p.strip()
+                if p.startswith('q='):
+                    try:
+                        q = float(p[2:])
+                    except ValueError:
+                        q = 0.0
+            if coding!='*' or allowed is None:
+                allowed = q > 0
+    return bool(allowed)
+
+
+_GZIP_TYPES = frozenset([
+    'text/html', 'text/plain', 'text/css', 'text/xml', 'text/javascript',
+    'application/json', 'application/javascript', 'application/xml', 'image/svg+xml'])
+
+def _gzip_body(headers, body, compressed=None):
+    '''
+    Return the headers and body of a 200 response with the headers from
+    _gzip_headers() for a client accepting gzip, the body gzipped. A str or
+    list body is compressed at once and gets a Content-Length, unless
+    compressed already holds it compressed; any other iterable is compressed
+    as it is read and sent without Content-Length.
+
+    >>> headers = [('Content-Type', 'application/json'), ('ETag', '"abc"'), ('Content-Length', '1200')]
+    >>> _compressible(headers, ['{}' * 600], 1024), _compressible(headers, ['{}'], 1024)
+    (True, False)
+    >>> h, accepted = _gzip_headers(Request({}), headers)
+    >>> sorted(h), accepted
+    ([('Content-Length', '1200'), ('Content-Type', 'application/json'), ('ETag', '"abc"'), ('Vary', 'Accept-Encoding')], False)
+    >>> h, accepted = _gzip_headers(Request({'HTTP_ACCEPT_ENCODING': 'gzip'}), headers)
+    >>> h, b = _gzip_body(h, ['{}' * 600])
+    >>> sorted(h)
+    [('Content-Encoding', 'gzip'), ('Content-Length', '31'), ('Content-Type', 'application/json'), ('ETag', 'W/"abc"'), ('Vary', 'Accept-Encoding')]
+    >>> zlib.decompress(''.join(b), 31) == '{}' * 600
+    True
+    >>> h, b = _gzip_body([], (c for c in ['{}'] * 600))
+    >>> h, zlib.decompress(''.join(b), 31) == '{}' * 600
+    ([], True)
+    '''
+    if compressed is None and isinstance(body, (str, list)):
+        compressed = _gzip_data(body if isinstance(body, str) else ''.join(body))
+    if compressed is not None:
+        return headers + [('Content-Length', str(len(compressed)))], [compressed]
+    return headers, _gzip_stream(body)
+
+def _compressible(headers, body, min_size, file_wrapper=None):
+    '''
+    Whether a 200 response with body is gzipped for a client accepting it: it
+    is not encoded yet, its Content-Type is in _GZIP_TYPES and it has at
+    least min_size bytes, by Content-Length unless body is a str or list.
+    Bodies of wsgi.file_wrapper are left to the server.
+
+    >>> headers = [('Content-Type', 'text/css'), ('Content-Length', '2000')]
+    >>> _compressible(headers, None, 1024), _compressible(headers, 'a{}', 1024)
+    (True, False)
+    >>> from wsgiref.util import FileWrapper
+    >>> _compressible(headers, FileWrapper(StringIO('a{}')), 1024, FileWrapper)
+    False
+    '''
+    values = dict(headers)
+    if 'Content-Encoding' in values or values.get('Content-Type', '').split(';')[0].strip().lower() not in _GZIP_TYPES:
+        return False
+    if isinstance(body, str):
+        size = len(body)
+    elif isinstance(body, list):
+        size = sum(map(len, body))
+    elif isinstance(file_wrapper, (type, types.ClassType)) and isinstance(body, file_wrapper):
+        return False
+    else:
+        size = int(values.get('Content-Length') or min_size)
+    return size >= min_size
+
+def _gzip_headers(request, headers):
+    '''
+    The headers of a compressible response: Vary names Accept-Encoding and,
+    if the client accepts gzip, the ETag is weak, Content-Encoding is gzip
+    and Content-Length is dropped. Return them and whether the client
+    accepts gzip. A 304 gets the same headers as the 200 it stands for.
+    '''
+    values = dict(headers)
+    vary = values.get('Vary')
+    if vary is None:
+        vary = 'Accept-Encoding'
+    elif 'accept-encoding' not in vary.lower():
+        vary = vary + ', Accept-Encoding'
+    L = [(k, v) for k, v in headers if k!='Vary']
+    L.append(('Vary', vary))
+    if not _accepts_gzip(request.header('ACCEPT-ENCODING')):
+        return L, False
+    # the representation differs from the uncompressed one, so the ETag can only be weak:
+    L = [(k, 'W/' + v if k=='ETag' and not v.startswith('W/') else v) for k, v in L if k!='Content-Length']
+    L.append(('Content-Encoding', 'gzip'))
+    return L, True
+
+def _gzip_data(data, level=6):
+    c = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    return c.compress(data) + c.flush()
+
+def _gzip_stream(body, level=6):
+    '''
+    Compress an iterable body as it is read. Each chunk is flushed, so a
+    body produced incrementally is also sent incrementally.
+
+    >>> c = zlib.decompressobj(31)
+    >>> [c.decompress(data) for data in _gzip_stream(iter(['abc', 'def']))]
+    ['abc', 'def', '']
+    '''
+    c = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    try:
+        for chunk in body:
+            data = c.compress(chunk) + c.flush(zlib.Z_SYNC_FLUSH)
+            if data:
+                yield data
+        yield c.flush()
+    finally:
+        close = getattr(body, 'close', None)
+        if close:
+            close()
+
+
+def _parse_range(value, size):
+    '''
+    The first and last byte of a single byte Range of a size bytes file,
+    None if there is no Range or it has several ranges, False if it cannot
+    be satisfied.
+
+    >>> _parse_range('bytes=0-99', 1000)
+    (0, 99)
+    >>> _parse_range('bytes=900-', 1000)
+    (900, 999)
+    >>> _parse_range('bytes=-100', 1000)
+    (900, 999)
+    >>> _parse_range('bytes=500-2000', 1000)
+    (500, 999)
+    >>> _parse_range('bytes=1000-', 1000)
+    False
+    >>> _parse_range('bytes=0-1,5-9', 1000)
+    '''
+    m = value and _RE_BYTE_RANGE.match(value)
+    if not m or m.group(1)==m.group(2)=='':
+        return None
+    if m.group(1)=='':
+        start, end = max(size - int(m.group(2)), 0), size - 1
+    else:
+        start = int(m.group(1))
+        end = min(int(m.group(2)), size - 1) if m.group(2) else size - 1
+    if start > end or start >= size:
+        return False
+    return start, end
+
+_RE_BYTE_RANGE = re.compile(r'^bytes=(\d*)-(\d*)$')
 
 
 def favicon_handler():
     return _static_file_generator('favicon.ico')
 
 
-def _static_file_generator(fpath):
-    BLOCK_SIZE = 8192
+def _not_modified(request, headers):
+    '''
+    Whether a GET answered with the validators in headers can be 304 Not
+    Modified: If-None-Match lists its ETag, or, without If-None-Match,
+    If-Modified-Since is not before its Last-Modified.
+
+    >>> headers = [('ETag', '"abc"'), ('Last-Modified', 'Sat, 14 Jul 2012 14:06:34 GMT')]
+    >>> _not_modified(Request({'HTTP_IF_NONE_MATCH': '"xyz", W/"abc"'}), headers)
+    True
+    >>> _not_modified(Request({'HTTP_IF_NONE_MATCH': '"xyz"', 'HTTP_IF_MODIFIED_SINCE': 'Sat, 14 Jul 2012 14:06:34 GMT'}), headers)
+    False
+    >>> _not_modified(Request({'HTTP_IF_MODIFIED_SINCE': 'Sat, 14 Jul 2012 14:06:34 GMT'}), headers)
+    True
+    >>> _not_modified(Request({'HTTP_IF_MODIFIED_SINCE': 'Sat, 14 Jul 2012 14:06:33 GMT'}), headers)
+    False
+    >>> _not_modified(Request({}), headers)
+    False
+    '''
+    etag = last_modified = None
+    for k, v in headers:
+        if k=='ETag':
+            etag = v
+        elif k=='Last-Modified':
+            last_modified = v
+    if_none_match = request.header('IF-NONE-MATCH')
+    if if_none_match is not None:
+        if etag is None:
+            return False
+        # weak comparison, as the body may be compressed on the way:
+        tags = [t.strip() for t in if_none_match.split(',')]
+        return '*' in tags or _weak_etag(etag) in [_weak_etag(t) for t in tags]
+    if_modified_since = request.header('IF-MODIFIED-SINCE')
+    if if_modified_since and last_modified:
+        since = email.utils.parsedate_tz(if_modified_since)
+        modified = email.utils.parsedate_tz(last_modified)
+        return bool(since and modified and email.utils.mktime_tz(modified) <= email.utils.mktime_tz(since))
+    return False
+
+def _weak_etag(tag):
+    return tag[2:] if tag.startswith('W/') else tag
+
+
+_BLOCK_SIZE = 65536
+
+def _static_file_generator(fpath, start=0, length=None):
     with open(fpath, 'rb') as f:
-        block = f.read(BLOCK_SIZE)
-        while block:
+        if start:
+            f.seek(start)
+        remaining = length
+        while remaining is None or remaining > 0:
+            block = f.read(_BLOCK_SIZE if remaining is None else min(_BLOCK_SIZE, remaining))
+            if not block:
+                break
+            if remaining is not None:
+                remaining -= len(block)
             yield block
-            block = f.read(BLOCK_SIZE)
 
 
 def _default_error_handler(e, start_response, is_debug):
@@ -920,6 +1720,9 @@ class Jinja2TemplateEngine(TemplateEngine):
     def add_filter(self, name, fn_filter):
         self._env.filters[name] = fn_filter
 
+    def add_global(self, name, value):
+        self._env.globals[name] = value
+
     def __call__(self, path, model):
         return self._env.get_template(path).render(**model).encode('utf-8')
 
@@ -930,6 +1733,14 @@ class WSGIApplication(object):
     def __init__(self, document_root=None, **kw):
         self._running = False
         self._document_root = document_root
+        # optional factory of a context manager wrapping each request, e.g. db.request_connection:
+        self._request_scope = kw.get('request_scope', None)
+        # optional backend of @cached routes, e.g. MemoryResponseCache():
+        self._response_cache = kw.get('response_cache', None)
+        # serve /static/ also when not in debug mode:
+        self._serve_static = kw.get('serve_static', False)
+        # gzip responses of at least this many bytes, or None to never compress:
+        self._gzip_min_size = kw.get('gzip_min_size', 1024)
 
         self._interceptors = []
         self._template_engine = None
@@ -1001,51 +1812,104 @@ class WSGIApplication(object):
             raise RuntimeError('Cannot modify WSGIApplication when running.')
         if debug:
             self._get_dynamic.append(StaticFileRoute())
+        elif self._serve_static:
+            self._get_dynamic.append(StaticFileRoute(check_interval=60))
         self._running = True
 
-        _application = Dict(document_root=self._document_root)
+        _application = Dict(document_root=self._document_root, response_cache=self._response_cache)
+
+        interceptors = self._interceptors
+        response_cache = self._response_cache
+        gzip_min_size = self._gzip_min_size
+        chains = {}
+        for route in self._get_static.values() + self._post_static.values() + self._get_dynamic + self._post_dynamic:
+            fn = route
+            cache = getattr(route, 'func', None) and getattr(route.func, '__web_cache__', None)
+            if cache and response_cache and route.method=='GET':
+                fn = _build_cached_fn(route, response_cache, *cache)
+            chains[route] = _build_route_chain(route, interceptors, fn)
+        routers = {
+            'GET': (self._get_static, _Router(self._get_dynamic)),
+            'POST': (self._post_static, _Router(self._post_dynamic)),
+        }
+
+        def fn_notfound():
+            raise notfound()
 
-        def fn_route():
-            request_method = ctx.request.request_method
-            path_info = ctx.request.path_info
-            if request_method=='GET':
-                fn = self._get_static.get(path_info, None)
-                if fn:
-                    return fn()
-                else:
-                    for fn in self._get_dynamic:
-                        args = fn.match(path_info)
-                        if args:
-                            return fn(*args)
-                raise notfound()
-            elif request_method=='POST':
-                fn = self._post_static.get(path_info, None)
-                if fn:
-                    return fn()
-                else:
-                    for fn in self._post_dynamic:
-                        args = fn.match(path_info)
-                        if args:
-                            return fn(*args)
-                raise notfound()
-            else:
-                raise badrequest()
+        def fn_badrequest():
+            raise badrequest()
 
-        fn_exec = _build_interceptor_chain(fn_route, *self._interceptors)
+        # requests matching no route still pass the interceptors, checked by path:
+        fn_notfound = _build_interceptor_chain(fn_notfound, *interceptors)
+        fn_badrequest = _build_interceptor_chain(fn_badrequest, *interceptors)
+
+        def fn_exec():
+            static, router = routers.get(ctx.request.request_method, (None, None))
+            if static is None:
+                return fn_badrequest()
+            path_info = ctx.request.path_info
+            route = static.get(path_info, None)
+            if route:
+                return chains[route]()
+            m = router.match(path_info)
+            if m:
+                return chains[m[0]](*m[1])
+            return fn_notfound()
 
         def wsgi(env, start_response):
             ctx.application = _application
             ctx.request = Request(env)
             response = ctx.response = Response()
+            scope = self._request_scope() if self._request_scope else None
             try:
+                if scope:
+                    scope.__enter__()
                 r = fn_exec()
-                if isinstance(r, Template):
-                    r = self._template_engine(r.template_name, r.model)
-                elif isinstance(r, unicode):
-                    r = r.encode('utf-8')
-                elif r is None:
-                    r = []
-                start_response(response.status, response.headers)
+                is_get = ctx.request.request_method=='GET'
+                compressed = None
+                if isinstance(r, _CachedResponse):
+                    status, headers, r, compressed = r.status, r.headers, r.body, r.compressed
+                else:
+                    if isinstance(r, Template):
+                        r = self._template_engine(r.template_name, r.model)
+                    elif isinstance(r, unicode):
+                        r = r.encode('utf-8')
+                    elif r is None:
+                        r = []
+                    if is_get and response.status_code==200 and isinstance(r, (str, list)):
+                        if isinstance(r, list):
+                            r = ''.join(r)
+                        if response.etag is None:
+                            response.etag = hashlib.md5(r).hexdigest()
+                    status, headers = response.status, response.headers
+                    store = getattr(ctx.request, '_response_cache', None)
+                    if store and response.status_code==200 and not hasattr(response, '_cookies') and isinstance(r, str):
+                        if gzip_min_size is not None and _compressible(headers, r, gzip_min_size):
+                            compressed = _gzip_data(r)
+                        response_cache.put(store[0], (status, headers, r, compressed), store[1], store[2])
+                if isinstance(r, str):
+                    # one write instead of one per byte:
+                    r = [r]
+                # only a full 200 body, or a 304 carrying the headers of the 200 it stands
+                # for: 206 and 416 responses keep their own headers.
+                is_200, is_304 = status.startswith('200 '), status.startswith('304 ')
+                if is_200 or is_304:
+                    if is_200 and isinstance(r, list) and not any(k=='Content-Length' for k, v in headers):
+                        headers = headers + [('Content-Length', str(sum(map(len, r))))]
+                    gzipped = False
+                    if gzip_min_size is not None and _compressible(headers, r if is_200 else None, gzip_min_size, env.get('wsgi.file_wrapper')):
+                        headers, gzipped = _gzip_headers(ctx.request, headers)
+                    if is_200 and is_get and _not_modified(ctx.request, headers):
+                        close = getattr(r, 'close', None)
+                        if close:
+                            close()
+                        status, is_304 = '304 Not Modified', True
+                    if is_304:
+                        start_response(status, [(k, v) for k, v in headers if k not in ('Content-Type', 'Content-Length', 'Content-Encoding')])
+                        return []
+                    if gzipped:
+                        headers, r = _gzip_body(headers, r, compressed)
+                start_response(status, headers)
                 return r
             except RedirectError, e:
                 response.set_header('Location', e.location)
@@ -1070,6 +1934,8 @@ class WSGIApplication(object):
                     stacks.replace('<', '&lt;').replace('>', '&gt;'),
                     '</pre></div></body></html>']
             finally:
+                if scope:
+                    scope.__exit__(None, None, None)
                 del ctx.application
                 del ctx.request
                 del ctx.response
@@ -90,7 +90,10 @@ import os
 import sys
 from pprint import pprint
 import re
+import time
 import logging
+import threading
+from collections import OrderedDict
 try:
     from hashlib import md5
 except ImportError:
@@ -151,6 +154,9 @@ g_escape_table = dict([(ch, _hash_text(ch))
 class MarkdownError(Exception):
     pass
 
+class _BudgetExceeded(Exception):
+    pass
+
 
 
 #---- public api
@@ -169,11 +175,115 @@ def markdown_path(path, encoding="utf-8",
 
 def markdown(text, html4tags=False, tab_width=DEFAULT_TAB_WIDTH,
              safe_mode=None, extras=None, link_patterns=None,
-             use_file_vars=False):
+             use_file_vars=False, max_size=None, time_budget=None):
     return Markdown(html4tags=html4tags, tab_width=tab_width,
                     safe_mode=safe_mode, extras=extras,
                     link_patterns=link_patterns,
-                    use_file_vars=use_file_vars).convert(text)
+                    use_file_vars=use_file_vars, max_size=max_size,
+                    time_budget=time_budget).convert(text)
+
+_converters = threading.local()
+
+def get_markdown(html4tags=False, tab_width=DEFAULT_TAB_WIDTH,
+                 safe_mode=None, extras=None, link_patterns=None,
+                 use_file_vars=False, max_size=None, time_budget=None,
+                 incremental=False):
+    """Return a `Markdown` instance for these options, private to the
+    calling thread.
+
+    The instance is built on the first call in a thread and handed out
+    again on later calls with the same options, so the constructor cost
+    is paid once per thread. `convert()` resets all per-document state, so
+    `get_markdown(**opts).convert(text)` gives the same result as
+    `markdown(text, **opts)`. If `incremental` is true the instance is an
+    `IncrementalMarkdown` using the default block cache.
+
+    Per-document state does not build up in the reused instance:
+
+    >>> md = get_markdown()
+    >>> text = "`code %d`\\n\\n    block %d\\n"
+    >>> html = md.convert(text % (0, 0))
+    >>> size = len(md._escape_table)
+    >>> for i in range(100):
+    ...     html = md.convert(text % (i, i))
+    >>> len(md._escape_table) == size
+    True
+    """
+    if isinstance(extras, dict):
+        extras_key = tuple(sorted(extras.items()))
+    else:
+        extras_key = extras and tuple(sorted(extras))
+    key = (html4tags, tab_width, safe_mode, extras_key,
+           link_patterns and tuple(link_patterns), use_file_vars,
+           max_size, time_budget, incremental)
+    try:
+        cache = _converters.cache
+    except AttributeError:
+        cache = _converters.cache = {}
+    try:
+        md = cache.get(key)
+    except TypeError:  # unhashable extras arguments: don't cache
+        key = md = None
+    if md is None:
+        cls = incremental and IncrementalMarkdown or Markdown
+        md = cls(html4tags=html4tags, tab_width=tab_width,
+                 safe_mode=safe_mode, extras=extras,
+                 link_patterns=link_patterns, use_file_vars=use_file_vars,
+                 max_size=max_size, time_budget=time_budget)
+        if key is not None:
+            cache[key] = md
+    return md
+
+# Batches smaller than this many characters in total are converted on the
+# calling thread by `convert_many()`, where the pool's IPC would cost more
+# than it saves.
+MIN_POOL_BATCH_SIZE = 16384
+
+_pool = None
+
+def start_pool(workers=None):
+    """Start the pool of `workers` processes (default: one per CPU) that
+    `convert_many()` uses for large batches. With `workers=1`, or where
+    processes cannot be started, no pool is started and None is returned.
+
+    The workers are forked from the calling process, so call this at
+    startup, before any threads are started or sockets (e.g. database
+    connections) are opened: a process forked later would inherit them,
+    and any locks other threads held at the time.
+    """
+    global _pool
+    if _pool is None and workers != 1:
+        try:
+            import multiprocessing, atexit
+            _pool = multiprocessing.Pool(workers)
+        except (ImportError, OSError, NotImplementedError), ex:
+            log.warn("no process pool (%s), converting on the calling "
+                     "thread", ex)
+        else:
+            atexit.register(_pool.terminate)
+    return _pool
+
+def _convert_in_pool(args):
+    text, options = args
+    return get_markdown(**options).convert(text)
+
+def convert_many(texts, workers=None, **options):
+    """Convert a batch of texts and return the results in order.
+
+    Batches of MIN_POOL_BATCH_SIZE characters or more are converted in
+    parallel by the pool of `start_pool()`, so that the GIL does not
+    serialize them. Smaller batches, batches given `workers=1`, and all
+    batches if no pool was started, are converted on the calling thread:
+    the pool is never started here, as this may run on a request thread.
+    `options` are the keyword arguments of `get_markdown()`.
+    """
+    texts = list(texts)
+    if _pool is not None and workers != 1 and len(texts) > 1 \
+            and sum(map(len, texts)) >= MIN_POOL_BATCH_SIZE:
+        return _pool.map(_convert_in_pool,
+                         [(text, options) for text in texts])
+    md = get_markdown(**options)
+    return [md.convert(text) for text in texts]
 
 class Markdown(object):
     # The dict of "extras" to enable in processing -- a mapping of
@@ -196,8 +306,18 @@ class Markdown(object):
 
     _ws_only_line_re = re.compile(r"^[ \t]+$", re.M)
 
+    # Input longer than `max_size` characters, or whose conversion takes
+    # longer than `time_budget` seconds, is rendered as escaped paragraphs
+    # instead, and the result has an `escaped` attribute set to True. The
+    # time budget is checked between passes, so a single pass can still
+    # overrun it.
+    max_size = None
+    time_budget = None
+    _deadline = None
+
     def __init__(self, html4tags=False, tab_width=4, safe_mode=None,
-                 extras=None, link_patterns=None, use_file_vars=False):
+                 extras=None, link_patterns=None, use_file_vars=False,
+                 max_size=None, time_budget=None):
         if html4tags:
             self.empty_element_suffix = ">"
         else:
@@ -228,13 +348,12 @@ class Markdown(object):
 
         self.link_patterns = link_patterns
         self.use_file_vars = use_file_vars
+        if max_size is not None:
+            self.max_size = max_size
+        if time_budget is not None:
+            self.time_budget = time_budget
         self._outdent_re = re.compile(r'^(\t|[ ]{1,%d})' % tab_width, re.M)
 
-        self._escape_table = g_escape_table.copy()
-        if "smarty-pants" in self.extras:
-            self._escape_table['"'] = _hash_text('"')
-            self._escape_table["'"] = _hash_text("'")
-
     def reset(self):
         self.urls = {}
         self.titles = {}
@@ -242,6 +361,13 @@ class Markdown(object):
         self.html_spans = {}
         self.list_level = 0
         self.extras = self._instance_extras.copy()
+        self._toc = None
+        # `_encode_code()` adds an entry per code span or block, so start
+        # each document from the global table again.
+        self._escape_table = g_escape_table.copy()
+        if "smarty-pants" in self.extras:
+            self._escape_table['"'] = _hash_text('"')
+            self._escape_table["'"] = _hash_text("'")
         if "footnotes" in self.extras:
             self.footnotes = {}
             self.footnote_ids = []
@@ -256,6 +382,73 @@ class Markdown(object):
 
     def convert(self, text):
         """Convert the given text."""
+        if self.max_size and len(text) > self.max_size:
+            log.warn("input of %d characters exceeds max_size, "
+                     "rendering escaped text", len(text))
+            return self._convert_escaped(text)
+        if self.time_budget:
+            self._deadline = time.time() + self.time_budget
+        try:
+            return self._convert(text)
+        except _BudgetExceeded:
+            log.warn("conversion exceeded time_budget of %ss, "
+                     "rendering escaped text", self.time_budget)
+            return self._convert_escaped(text)
+        except RuntimeError, ex:
+            # Deeply nested blockquotes or lists recurse once per level.
+            if "recursion" not in str(ex):
+                raise
+            log.warn("input nests too deeply, rendering escaped text")
+            return self._convert_escaped(text)
+        finally:
+            self._deadline = None
+
+    def _check_budget(self):
+        if self._deadline and time.time() > self._deadline:
+            raise _BudgetExceeded()
+
+    def _budget_sub(self, regex, repl, text, starts):
+        """The same as `regex.sub(repl, text)`, but checking the time budget
+        between match attempts, for patterns that can scan the rest of the
+        text from each start: a single `sub()` call would overrun it.
+        `starts` must match wherever `regex` can.
+        """
+        if not self._deadline:
+            return regex.sub(repl, text)
+        parts = []
+        pos = last = 0
+        while True:
+            start = starts.search(text, pos)
+            if start is None:
+                break
+            self._check_budget()
+            match = regex.match(text, start.start())
+            if match is None or match.end() == match.start():
+                pos = start.start() + 1
+                continue
+            parts.append(text[last:match.start()])
+            if callable(repl):
+                parts.append(repl(match))
+            else:
+                parts.append(match.expand(repl))
+            last = pos = match.end()
+        parts.append(text[last:])
+        return "".join(parts)
+
+    def _convert_escaped(self, text):
+        """Render text as escaped paragraphs, in linear time."""
+        if not isinstance(text, unicode):
+            text = unicode(text, 'utf-8')
+        text = re.sub("\r\n|\r", "\n", text).strip("\n")
+        text = text.replace('&', '&amp;').replace('<', '&lt;') \
+            .replace('>', '&gt;')
+        grafs = ["<p>%s</p>" % graf for graf in re.split(r"\n{2,}", text)
+                 if graf.strip()]
+        rv = UnicodeWithAttrs("\n\n".join(grafs) + "\n")
+        rv.escaped = True
+        return rv
+
+    def _convert(self, text):
         # Main function. The order in which other subs are called here is
         # essential. Link and image substitutions need to happen before
         # _EscapeSpecialChars(), so that any *'s or _'s in the <a>
@@ -322,7 +515,7 @@ class Markdown(object):
             text = self._strip_footnote_definitions(text)
         text = self._strip_link_definitions(text)
 
-        text = self._run_block_gamut(text)
+        text = self._run_document_gamut(text)
 
         if "footnotes" in self.extras:
             text = self._add_footnotes(text)
@@ -346,6 +539,11 @@ class Markdown(object):
             rv.metadata = self.metadata
         return rv
 
+    def _run_document_gamut(self, text):
+        # The top-level block gamut over the whole document. Overridden
+        # by `IncrementalMarkdown`.
+        return self._run_block_gamut(text)
+
     def postprocess(self, text):
         """A hook for subclasses to do some postprocessing of the html, if
         desired. This is called before unescaping of special chars and
@@ -563,6 +761,8 @@ class Markdown(object):
         """ % _block_tags_b,
         re.X | re.M)
 
+    _tag_block_start_re = re.compile(r"^<", re.M)
+
     _html_markdown_attr_re = re.compile(
         r'''\s+markdown=("1"|'1')''')
     def _hash_html_block_sub(self, match, raw=False):
@@ -617,10 +817,14 @@ class Markdown(object):
         # the inner nested divs must be indented.
         # We need to do this before the next, more liberal match, because the next
         # match will start at the first `<div>` and stop at the first `</div>`.
-        text = self._strict_tag_block_re.sub(hash_html_block_sub, text)
+        text = self._budget_sub(self._strict_tag_block_re,
+                                hash_html_block_sub, text,
+                                self._tag_block_start_re)
 
         # Now match more liberally, simply from `\n<tag>` to `</tag>\n`
-        text = self._liberal_tag_block_re.sub(hash_html_block_sub, text)
+        text = self._budget_sub(self._liberal_tag_block_re,
+                                hash_html_block_sub, text,
+                                self._tag_block_start_re)
 
         # Special case just for <hr />. It was easier to make a special
         # case than to make the other regex more complicated.
@@ -783,6 +987,7 @@ class Markdown(object):
     def _run_block_gamut(self, text):
         # These are all the transformations that form block-level
         # tags like paragraphs, headers, and list items.
+        self._check_budget()
 
         if "fenced-code-blocks" in self.extras:
             text = self._do_fenced_code_blocks(text)
@@ -886,6 +1091,7 @@ class Markdown(object):
     def _run_span_gamut(self, text):
         # These are all the transformations that occur *within* block-level
         # tags like paragraphs, headers, and list items.
+        self._check_budget()
 
         text = self._do_code_spans(text)
 
@@ -1063,6 +1269,7 @@ class Markdown(object):
                 start_idx = text.index('[', curr_pos)
             except ValueError:
                 break
+            self._check_budget()
             text_length = len(text)
 
             # Find the matching closing ']'.
@@ -1326,6 +1533,7 @@ class Markdown(object):
         # Iterate over each *non-overlapping* list match.
         pos = 0
         while True:
+            self._check_budget()
             # Find the *first* hit for either list style (ul or ol). We
             # match ul and ol separately to avoid adjacent lists of different
             # types running into each other (see issue #16).
@@ -1429,37 +1637,48 @@ class Markdown(object):
         return list_str
 
     def _get_pygments_lexer(self, lexer_name):
+        try:
+            return _pygments_lexers[lexer_name]
+        except KeyError:
+            pass
         try:
             from pygments import lexers, util
         except ImportError:
             return None
         try:
-            return lexers.get_lexer_by_name(lexer_name)
+            lexer = lexers.get_lexer_by_name(lexer_name)
         except util.ClassNotFound:
-            return None
+            lexer = None
+        _pygments_lexers[lexer_name] = lexer
+        return lexer
 
     def _color_with_pygments(self, codeblock, lexer, **formatter_opts):
         import pygments
-        import pygments.formatters
-
-        class HtmlCodeFormatter(pygments.formatters.HtmlFormatter):
-            def _wrap_code(self, inner):
-                """A function for use in a Pygments Formatter which
-                wraps in <code> tags.
-                """
-                yield 0, "<code>"
-                for tup in inner:
-                    yield tup
-                yield 0, "</code>"
-
-            def wrap(self, source, outfile):
-                """Return the source with a code, pre, and div."""
-                return self._wrap_div(self._wrap_pre(self._wrap_code(source)))
 
         formatter_opts.setdefault("cssclass", "codehilite")
-        formatter = HtmlCodeFormatter(**formatter_opts)
+        key = repr(sorted(formatter_opts.items()))
+        formatter = _pygments_formatters.get(key)
+        if formatter is None:
+            formatter = _html_code_formatter_class()(**formatter_opts)
+            _pygments_formatters[key] = formatter
         return pygments.highlight(codeblock, lexer, formatter)
 
+    def _highlight(self, codeblock, lexer_name, formatter_opts):
+        """Return codeblock colored by Pygments, or None if there is no
+        such lexer. Results are cached in `highlight_cache`.
+        """
+        key = (self.__class__, lexer_name, repr(sorted(formatter_opts.items())),
+               md5(codeblock.encode("utf-8")).hexdigest())
+        colored = highlight_cache.get(key)
+        if colored is None:
+            lexer = self._get_pygments_lexer(lexer_name)
+            if not lexer:
+                return None
+            colored = self._color_with_pygments(codeblock, lexer,
+                                                **formatter_opts)
+            highlight_cache.put(key, colored)
+        return colored
+
     def _code_block_sub(self, match, is_fenced_code_block=False):
         lexer_name = None
         if is_fenced_code_block:
@@ -1483,10 +1702,8 @@ class Markdown(object):
                 formatter_opts = self.extras['code-color'] or {}
 
         if lexer_name:
-            lexer = self._get_pygments_lexer(lexer_name)
-            if lexer:
-                colored = self._color_with_pygments(codeblock, lexer,
-                                                    **formatter_opts)
+            colored = self._highlight(codeblock, lexer_name, formatter_opts)
+            if colored is not None:
                 return "\n\n%s\n\n" % colored
 
         codeblock = self._encode_code(codeblock)
@@ -1610,14 +1827,19 @@ class Markdown(object):
     _em_re = re.compile(r"(\*|_)(?=\S)(.+?)(?<=\S)\1", re.S)
     _code_friendly_strong_re = re.compile(r"\*\*(?=\S)(.+?[*_]*)(?<=\S)\*\*", re.S)
     _code_friendly_em_re = re.compile(r"\*(?=\S)(.+?)(?<=\S)\*", re.S)
+    _emphasis_start_re = re.compile(r"[*_]")
     def _do_italics_and_bold(self, text):
         # <strong> must go first:
+        starts = self._emphasis_start_re
         if "code-friendly" in self.extras:
-            text = self._code_friendly_strong_re.sub(r"<strong>\1</strong>", text)
-            text = self._code_friendly_em_re.sub(r"<em>\1</em>", text)
+            text = self._budget_sub(self._code_friendly_strong_re,
+                                    r"<strong>\1</strong>", text, starts)
+            text = self._budget_sub(self._code_friendly_em_re,
+                                    r"<em>\1</em>", text, starts)
         else:
-            text = self._strong_re.sub(r"<strong>\2</strong>", text)
-            text = self._em_re.sub(r"<em>\2</em>", text)
+            text = self._budget_sub(self._strong_re,
+                                    r"<strong>\2</strong>", text, starts)
+            text = self._budget_sub(self._em_re, r"<em>\2</em>", text, starts)
         return text
 
     # "smarty-pants" extra: Very liberal in interpreting a single prime as an
@@ -1890,8 +2112,272 @@ class MarkdownWithExtras(Markdown):
     extras = ["footnotes", "code-color"]
 
 
+class LRUCache(object):
+    """A thread-safe, bounded cache that evicts the least recently used
+    entries. Used for rendered blocks and highlighted code.
+    """
+    def __init__(self, capacity=4096):
+        self.capacity = capacity
+        self._lock = threading.Lock()
+        self._data = OrderedDict()
+
+    def __len__(self):
+        return len(self._data)
+
+    def get(self, key):
+        with self._lock:
+            value = self._data.pop(key, None)
+            if value is not None:
+                self._data[key] = value
+            return value
+
+    def put(self, key, value):
+        with self._lock:
+            self._data.pop(key, None)
+            self._data[key] = value
+            while len(self._data) > self.capacity:
+                self._data.popitem(last=False)
+
+# Rendered top-level blocks shared by `IncrementalMarkdown` instances.
+default_block_cache = LRUCache()
+
+class IncrementalMarkdown(Markdown):
+    """A markdowner that renders each top-level block of a document once.
+
+    After the document-level passes (link definitions, html blocks), the
+    text is split at blank lines into top-level blocks, and the html of
+    each block is cached by a hash of its source. Converting an edited
+    document re-renders only the changed blocks.
+
+    A cached block records the link definitions it looked up and is only
+    reused if they are unchanged, so editing a definition re-renders
+    exactly the blocks that use it. The html it hashed is replayed.
+
+    Footnotes and header ids are numbered across the whole document in
+    the order of the block passes rather than of the blocks, so documents
+    using the "footnotes" or "header-ids" (or "toc") extras are rendered
+    in full.
+
+    A block replayed on another instance renders the same as it did on
+    the instance that cached it:
+
+    >>> cache = LRUCache()
+    >>> text = "Some `code` here.\\n\\n```\\nfenced <code>\\n```\\n"
+    >>> first = IncrementalMarkdown(extras=["fenced-code-blocks"],
+    ...                             block_cache=cache).convert(text)
+    >>> second = IncrementalMarkdown(extras=["fenced-code-blocks"],
+    ...                              block_cache=cache).convert(text)
+    >>> second == first == Markdown(extras=["fenced-code-blocks"]).convert(text)
+    True
+    """
+    def __init__(self, html4tags=False, tab_width=4, safe_mode=None,
+                 extras=None, link_patterns=None, use_file_vars=False,
+                 max_size=None, time_budget=None, block_cache=None):
+        Markdown.__init__(self, html4tags=html4tags, tab_width=tab_width,
+                          safe_mode=safe_mode, extras=extras,
+                          link_patterns=link_patterns,
+                          use_file_vars=use_file_vars, max_size=max_size,
+                          time_budget=time_budget)
+        if block_cache is None:
+            block_cache = default_block_cache
+        self.block_cache = block_cache
+        self._options_key = repr((self.__class__, self.empty_element_suffix,
+            tab_width, self.safe_mode, sorted(self.extras.items()),
+            link_patterns))
+
+    # Document state that blocks read and write. Hashed html and code are
+    # keyed by their own hash, so reading them is not a dependency, but
+    # the entries a block adds must be replayed for its hashes to unescape.
+    _tracked_dicts = ("urls", "titles", "html_blocks", "html_spans",
+                      "_escape_table")
+    _hashed_dicts = ("html_blocks", "html_spans", "_escape_table")
+
+    _block_split_re = re.compile(r"\n{2,}(?=[^\s>])")
+    _list_marker_re = re.compile(r"(?:%s)[ \t]" % Markdown._marker_any)
+
+    def _split_blocks(self, text):
+        """Split text at blank lines that no block construct spans: before
+        an unindented line that does not continue a list or blockquote,
+        outside fenced code blocks.
+        """
+        fences = []
+        if "fenced-code-blocks" in self.extras:
+            fences = [m.span() for m in
+                      self._fenced_code_block_re.finditer(text)]
+        blocks = []
+        start = 0
+        for match in self._block_split_re.finditer(text):
+            end = match.end()
+            if self._list_marker_re.match(text, end):
+                continue
+            if [1 for a, b in fences if a < end < b]:
+                continue
+            if match.start() > start:
+                blocks.append(text[start:end])
+            start = end
+        blocks.append(text[start:])
+        return blocks
+
+    def _run_document_gamut(self, text):
+        if self.use_file_vars or "footnotes" in self.extras \
+                or "header-ids" in self.extras:
+            # Per-document extras aren't part of the cache key.
+            return self._run_block_gamut(text)
+        tracked = []
+        for name in self._tracked_dicts:
+            d = _TrackingDict(getattr(self, name))
+            setattr(self, name, d)
+            tracked.append((name, d))
+        html = []
+        for block in self._split_blocks(text):
+            key = md5((self._options_key + block).encode("utf-8")).hexdigest()
+            entry = self.block_cache.get(key)
+            if entry is None or not self._replay_block(entry):
+                entry = self._render_block(block, tracked)
+                self.block_cache.put(key, entry)
+            if entry[0]:
+                html.append(entry[0])
+        for name, d in tracked:
+            setattr(self, name, dict(d))
+        return "\n\n".join(html)
+
+    def _render_block(self, block, tracked):
+        for name, d in tracked:
+            d.touched = {}
+        html = self._run_block_gamut(block)
+        reads = []
+        writes = []
+        for name, d in tracked:
+            if name not in self._hashed_dicts and d.touched:
+                reads.append((name, d.touched))
+            changed = dict([(k, dict.get(d, k, _missing))
+                            for k, v in d.touched.items()
+                            if dict.get(d, k, _missing) is not v])
+            if changed:
+                writes.append((name, changed))
+            d.touched = None
+        return html, reads, writes
+
+    def _replay_block(self, entry):
+        html, reads, writes = entry
+        for name, values in reads:
+            d = getattr(self, name)
+            for k, v in values.items():
+                if dict.get(d, k, _missing) != v:
+                    return False
+        for name, values in writes:
+            dict.update(getattr(self, name), values)
+        return True
+
+
+class PassProfiler(object):
+    """Time spent in each pass of `Markdown.convert()`, to find the passes
+    that go super-linear on some input:
+
+        md = Markdown()
+        profiler = PassProfiler(md)
+        md.convert(text)
+        print(profiler.report())
+
+    Times are given both with and without the nested passes. Recursive
+    calls of a pass are counted, but timed as part of the outermost call.
+    """
+    passes = ("preprocess", "_detab", "_extract_metadata",
+              "_hash_html_spans", "_hash_html_blocks",
+              "_strip_footnote_definitions", "_strip_link_definitions",
+              "_run_document_gamut", "_run_block_gamut",
+              "_do_fenced_code_blocks", "_do_headers", "_do_lists",
+              "_process_list_items", "_prepare_pyshell_blocks",
+              "_do_wiki_tables", "_do_code_blocks", "_do_block_quotes",
+              "_form_paragraphs", "_run_span_gamut", "_do_code_spans",
+              "_escape_special_chars", "_do_links", "_do_auto_links",
+              "_do_link_patterns", "_encode_backslash_escapes",
+              "_encode_amps_and_angles", "_do_italics_and_bold",
+              "_do_smart_punctuation", "_add_footnotes", "postprocess",
+              "_unescape_special_chars", "_unhash_html_spans")
+
+    def __init__(self, md):
+        self.stats = {}
+        self._nested = []   # seconds in nested passes, per running pass
+        for name in self.passes:
+            setattr(md, name, self._timed(name, getattr(md, name)))
+
+    def _timed(self, name, func):
+        # calls, seconds, seconds less nested passes, running
+        stat = self.stats[name] = [0, 0.0, 0.0, False]
+        nested = self._nested
+        def timed(*args, **kwargs):
+            stat[0] += 1
+            if stat[3]:
+                return func(*args, **kwargs)
+            stat[3] = True
+            nested.append(0.0)
+            start = time.time()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                seconds = time.time() - start
+                stat[1] += seconds
+                stat[2] += seconds - nested.pop()
+                stat[3] = False
+                if nested:
+                    nested[-1] += seconds
+        return timed
+
+    def reset(self):
+        for stat in self.stats.values():
+            stat[0] = 0
+            stat[1] = stat[2] = 0.0
+
+    def slowest(self):
+        """Return the name of the pass with the most time of its own, or
+        None if nothing ran.
+        """
+        timed = [(own, name) for name, (calls, seconds, own, running)
+                 in self.stats.items() if calls]
+        return timed and max(timed)[1] or None
+
+    def report(self):
+        """Return the passes that ran, slowest first, one per line."""
+        lines = ["%-28s %7s %12s %12s" % ("pass", "calls", "total", "own")]
+        for name, (calls, seconds, own, running) in sorted(
+                self.stats.items(), key=lambda item: -item[1][2]):
+            if calls:
+                lines.append("%-28s %7d %10.2fms %10.2fms"
+                             % (name, calls, seconds * 1000, own * 1000))
+        return "\n".join(lines)
+
+
 #---- internal support functions
 
+_missing = object()
+
+class _TrackingDict(dict):
+    """A dict that, while `touched` is a dict, records in it the value
+    of every key before its first read or write (`_missing` if absent).
+    """
+    touched = None
+
+    def _touch(self, key):
+        if self.touched is not None and key not in self.touched:
+            self.touched[key] = dict.get(self, key, _missing)
+
+    def __getitem__(self, key):
+        self._touch(key)
+        return dict.__getitem__(self, key)
+
+    def __contains__(self, key):
+        self._touch(key)
+        return dict.__contains__(self, key)
+
+    def get(self, key, default=None):
+        self._touch(key)
+        return dict.get(self, key, default)
+
+    def __setitem__(self, key, value):
+        self._touch(key)
+        dict.__setitem__(self, key, value)
+
 class UnicodeWithAttrs(unicode):
     """A subclass of unicode used for the return value of conversion to
     possibly attach some attributes. E.g. the "toc_html" attribute when
@@ -2140,6 +2626,35 @@ def _hr_tag_re_from_tab_width(tab_width):
         """ % (tab_width - 1), re.X)
 _hr_tag_re_from_tab_width = _memoized(_hr_tag_re_from_tab_width)
 
+# Pygments lexers by name (None if there is none) and formatters by
+# options. Both are reusable across documents and threads.
+_pygments_lexers = {}
+_pygments_formatters = {}
+
+# Pygments-highlighted code blocks by lexer name, formatter options and a
+# hash of the code.
+highlight_cache = LRUCache(1024)
+
+def _html_code_formatter_class():
+    import pygments.formatters
+
+    class HtmlCodeFormatter(pygments.formatters.HtmlFormatter):
+        def _wrap_code(self, inner):
+            """A function for use in a Pygments Formatter which
+            wraps in <code> tags.
+            """
+            yield 0, "<code>"
+            for tup in inner:
+                yield tup
+            yield 0, "</code>"
+
+        def wrap(self, source, outfile):
+            """Return the source with a code, pre, and div."""
+            return self._wrap_div(self._wrap_pre(self._wrap_code(source)))
+
+    return HtmlCodeFormatter
+_html_code_formatter_class = _memoized(_html_code_formatter_class)
+
 
 def _xml_escape_attr(attr, skip_single_quote=True):
     """Escape the given string for use in an HTML/XML tag attribute.
@@ -2214,11 +2729,13 @@ def main(argv=None):
                            "<https://github.com/trentm/python-markdown2/wiki/Extras>")
     parser.add_option("--link-patterns-file",
                       help="path to a link pattern file")
+    parser.add_option("--profile", action="store_true",
+                      help="report time per conversion pass on stderr")
     parser.add_option("--self-test", action="store_true",
                       help="run internal self-tests (some doctests)")
     parser.add_option("--compare", action="store_true",
                       help="run against Markdown.pl as well (for testing)")
-    parser.set_defaults(log_level=logging.INFO, compare=False,
+    parser.set_defaults(log_level=logging.INFO, compare=False, profile=False,
                         encoding="utf-8", safe_mode=None, use_file_vars=False)
     opts, paths = parser.parse_args()
     log.setLevel(opts.log_level)
@@ -2287,11 +2804,15 @@ def main(argv=None):
                 sys.stdout.write(perl_html.encode(
                     sys.stdout.encoding or "utf-8", 'xmlcharrefreplace'))
             print("==== markdown2.py ====")
-        html = markdown(text,
-            html4tags=opts.html4tags,
+        md = Markdown(html4tags=opts.html4tags,
             safe_mode=opts.safe_mode,
             extras=extras, link_patterns=link_patterns,
             use_file_vars=opts.use_file_vars)
+        if opts.profile:
+            profiler = PassProfiler(md)
+        html = md.convert(text)
+        if opts.profile:
+            sys.stderr.write(profiler.report() + "\n")
         if py3:
             sys.stdout.write(html)
         else:
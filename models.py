@@ -1,16 +1,56 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
 
-import time,uuid
+import sys,time,uuid
 
+import functools
+
+from lib import db
 from lib.db import next_id
 from lib.orm import Model, StringField, BooleanField, FloatField, TextField
+import render, session
 
 class Blog(Model):
     id = StringField(primary_key=True, default=next_id, ddl='varchar(50)')
     name = StringField(ddl='varchar(50)')
     content = TextField()
-    created_at = FloatField(updatable=False, default=time.time)
+    # content rendered by render.markdown(), and the hash it was rendered from:
+    html_content = TextField()
+    content_hash = StringField(ddl='varchar(40)')
+    created_at = FloatField(updatable=False, default=time.time, index=True)
+    # Last-Modified of the blog page; on existing tables:
+    # alter table blog add updated_at real not null default 0;
+    updated_at = FloatField(default=time.time)
+
+    def pre_insert(self):
+        self.render()
+
+    def pre_update(self):
+        self.updated_at = time.time()
+        self.render()
+
+    def render(self):
+        '''
+        Render content to html_content unless content_hash shows it is current.
+        Return True if rendered. If rendering fell back to escaped text, both
+        are left empty: pages get the escaped text from the render cache, and
+        render the content again once it expires there.
+        '''
+        if self.is_rendered():
+            return False
+        html = render.markdown(self.content)
+        h = render.HtmlCache.key(self.content)
+        if render.is_fallback(html):
+            html, h = '', ''
+        self.html_content = html
+        self.content_hash = h
+        return True
+
+    def is_rendered(self):
+        '''
+        Whether html_content was rendered from the current content.
+        '''
+        return bool(getattr(self, 'html_content', None)) and getattr(self, 'content_hash', None) == render.HtmlCache.key(self.content)
 
 class User(Model):
     id = StringField(primary_key=True, default=next_id, ddl='varchar(50)')
@@ -18,20 +58,61 @@ class User(Model):
     password = StringField(ddl='varchar(50)')
     admin = BooleanField()
     name = StringField(ddl='varchar(50)')
-    created_at = FloatField(updatable=False,default=time.time)
+    created_at = FloatField(updatable=False,default=time.time, index=True)
+
+    # after the write commits, or a request in between could cache the old row:
+    def post_update(self):
+        db.after_commit(functools.partial(session.cache.invalidate, self.id))
+
+    def post_delete(self):
+        db.after_commit(functools.partial(session.cache.invalidate, self.id))
+
+def _init_engine():
+    from config import configs
+    db.engine = db.create_engine_MySQLdb(configs.db.host, configs.db.user, configs.db.password, configs.db.database, configs.db.port)
 
 def init():
     try:
-        from lib import db
-        from config import configs
-        db.engine = db.create_engine_MySQLdb(configs.db.host, configs.db.user, configs.db.password, configs.db.database, configs.db.port)
+        _init_engine()
         Blog.create_table()
         User.create_table()
     except:
         raise Exception('init failed')
 
+def backfill(batch_size=100):
+    '''
+    Render html_content of all existing blogs, streaming batch_size rows at a
+    time and committing each batch. Blogs already rendered are skipped. Only
+    html_content and content_hash are written, so updated_at and with it the
+    Last-Modified of the pages stay as they are. Add the columns to an
+    existing table first:
+
+    alter table blog add html_content text not null, add content_hash varchar(40) not null default '';
+    '''
+    _init_engine()
+    L = []
+    n = 0
+    for blog in Blog.iter_by('order by created_at', batch_size=batch_size):
+        if blog.render():
+            L.append(blog)
+        if len(L) == batch_size:
+            n = n + _update_all(L)
+    n = n + _update_all(L)
+    print 'backfilled %s blogs.' % n
+
+def _update_all(blogs):
+    with db.transaction():
+        for blog in blogs:
+            db.update('update `blog` set `html_content`=?, `content_hash`=? where `id`=?', blog.html_content, blog.content_hash, blog.id)
+    n = len(blogs)
+    del blogs[:]
+    return n
+
 if __name__ == "__main__":
-    init()
+    if sys.argv[1:] == ['backfill']:
+        backfill()
+    else:
+        init()
 
     
 
@@ -0,0 +1,170 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+'''
+Markdown rendering of blog content, cached by content.
+
+The cache key is a hash of the markdown text plus the extras, so an entry
+never goes stale: changed content simply gets a new key. Rendered html is
+kept in an in-process LRU and, if configs.render.cache_dir is set, on disk
+so it survives restarts and is shared by processes.
+'''
+
+import os, time, hashlib, tempfile, logging
+
+import markdown2
+
+from config import configs
+from lib.lru import LRUCache
+
+
+class _DiskCache(object):
+    '''
+    Html files under directory, named by key. Writes are atomic renames so
+    concurrent readers never see a partial file.
+    '''
+    def __init__(self, directory):
+        self.directory = directory
+
+    def _path(self, key):
+        return os.path.join(self.directory, key[:2], key + '.html')
+
+    def get(self, key):
+        try:
+            with open(self._path(key), 'rb') as f:
+                return f.read().decode('utf-8')
+        except IOError:
+            return None
+
+    def put(self, key, value):
+        path = self._path(key)
+        try:
+            d = os.path.dirname(path)
+            if not os.path.isdir(d):
+                os.makedirs(d)
+            fd, tmp = tempfile.mkstemp(dir=d)
+            with os.fdopen(fd, 'wb') as f:
+                f.write(value.encode('utf-8'))
+            os.rename(tmp, path)
+        except (IOError, OSError), e:
+            logging.warning('[RENDER] cannot write %s: %s' % (path, e))
+
+    def evict(self, key):
+        try:
+            os.remove(self._path(key))
+        except OSError:
+            pass
+
+
+class HtmlCache(object):
+    '''
+    Rendered html by content hash, in an LRU tier and an optional disk tier.
+    The escaped text markdown2 falls back to is only kept in memory, for
+    fallback_ttl seconds, so that the content is tried again later but does
+    not cost a full time budget on every request.
+
+    >>> c = HtmlCache(2, fallback_ttl=-1)
+    >>> c.put('a', u'<p>a</p>')
+    >>> c.get('a')
+    u'<p>a</p>'
+    >>> c.put('b', markdown2.Markdown(max_size=1).convert(u'*b*'))
+    >>> c.get('b')
+    '''
+    def __init__(self, capacity=256, directory=None, fallback_ttl=60):
+        self.memory = LRUCache(capacity)
+        self.disk = _DiskCache(directory) if directory else None
+        self.fallbacks = LRUCache(capacity)
+        self.fallback_ttl = fallback_ttl
+
+    @staticmethod
+    def key(content, extras=None):
+        h = hashlib.sha1(content.encode('utf-8') if isinstance(content, unicode) else content)
+        if isinstance(extras, dict):
+            extras = extras.items()
+        h.update('\0%r' % (sorted(extras) if extras else None, ))
+        return h.hexdigest()
+
+    def get(self, key):
+        html = self.memory.get(key)
+        if html is None and self.disk:
+            html = self.disk.get(key)
+            if html is not None:
+                self.memory.put(key, html)
+        if html is None:
+            entry = self.fallbacks.get(key)
+            if entry and entry[0] >= time.time():
+                html = entry[1]
+        return html
+
+    def put(self, key, html):
+        if is_fallback(html):
+            self.fallbacks.put(key, (time.time() + self.fallback_ttl, html))
+            return
+        self.memory.put(key, html)
+        if self.disk:
+            self.disk.put(key, html)
+
+    def evict(self, key):
+        self.memory.pop(key)
+        self.fallbacks.pop(key)
+        if self.disk:
+            self.disk.evict(key)
+
+
+cache = HtmlCache(configs.render.cache_size, configs.render.cache_dir, configs.render.fallback_ttl)
+
+
+def _options(extras):
+    return dict(extras=extras, incremental=True, max_size=configs.render.max_size, time_budget=configs.render.time_budget)
+
+def markdown(content, extras=None):
+    '''
+    The same as markdown2.markdown(content, extras=extras), but cached, and
+    rendered by this thread's converter from markdown2.get_markdown(). The
+    converter is incremental, so an edited post re-renders only the blocks
+    that changed. Posts over configs.render.max_size characters, or taking
+    over configs.render.time_budget seconds, are rendered as escaped text.
+    '''
+    key = HtmlCache.key(content, extras)
+    html = cache.get(key)
+    if html is None:
+        html = markdown2.get_markdown(**_options(extras)).convert(content)
+        cache.put(key, html)
+    return html
+
+def markdown_many(contents, extras=None):
+    '''
+    The same as [markdown(c, extras) for c in contents], but the contents not
+    in the cache are rendered together by markdown2.convert_many(), in parallel
+    if the batch is large enough and start_pool() was called at startup.
+    '''
+    keys = [HtmlCache.key(content, extras) for content in contents]
+    L = [cache.get(key) for key in keys]
+    missing = [i for i, html in enumerate(L) if html is None]
+    if missing:
+        for i, html in zip(missing, markdown2.convert_many([contents[i] for i in missing], **_options(extras))):
+            cache.put(keys[i], html)
+            L[i] = html
+    return L
+
+def start_pool():
+    '''
+    Start the configs.render.workers processes that markdown_many() renders
+    large batches with. Call it at startup, before any thread is started or
+    database connection opened, as the workers are forked.
+    '''
+    markdown2.start_pool(configs.render.workers)
+
+def is_fallback(html):
+    '''
+    True if html is the escaped text markdown2 falls back to when content is
+    too large, too slow or nested too deeply to render. It is cached for
+    configs.render.fallback_ttl seconds only, and not stored in the blog.
+    '''
+    return getattr(html, 'escaped', False)
+
+def evict(content, extras=None):
+    '''
+    Drop the cached html of content.
+    '''
+    cache.evict(HtmlCache.key(content, extras))
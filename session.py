@@ -0,0 +1,107 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+'''
+Verified session cookies, so a request with a known cookie skips loading the
+user to check the signature. An entry lives until the cookie expires or for
+configs.session.cache_ttl seconds, whichever is first, and is dropped when
+an update or delete of its user commits. Other processes keep their entries
+until the ttl runs out.
+'''
+
+import time, threading
+
+from config import configs
+from lib.lru import LRUCache
+
+
+class SessionCache(object):
+    '''
+    Thread-safe LRU of cookie -> (user, expires), indexed by user id.
+
+    >>> from models import User
+    >>> c = SessionCache(2, 60)
+    >>> c.put('c1', User(id='u1', name='a'), time.time() + 10)
+    >>> c.put('c2', User(id='u2', name='b'), time.time() - 1)
+    >>> c.get('c1').name
+    'a'
+    >>> c.get('c2')
+    >>> c.put('c3', User(id='u1', name='a'), time.time() + 10)
+    >>> len(c)
+    2
+    >>> c.invalidate('u1')
+    >>> c.get('c1'), c.get('c3'), len(c)
+    (None, None, 0)
+
+    A user loaded before an invalidation is not cached after it:
+
+    >>> generation = c.generation
+    >>> c.invalidate('u2')
+    >>> c.put('c1', User(id='u1', name='a'), time.time() + 10, generation)
+    >>> c.get('c1')
+    '''
+    def __init__(self, capacity=1024, ttl=600):
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._lru = LRUCache(capacity)
+        self._by_user = {}
+        # incremented by every invalidate():
+        self.generation = 0
+
+    def __len__(self):
+        return len(self._lru)
+
+    def get(self, cookie):
+        '''
+        Return a copy of the user of cookie, or None if not cached or expired.
+        '''
+        entry = self._lru.get(cookie)
+        if entry is None:
+            return None
+        user, expires = entry
+        if expires < time.time():
+            with self._lock:
+                self._lru.pop(cookie)
+                self._unindex(cookie, user)
+            return None
+        return user.__class__(**user)
+
+    def put(self, cookie, user, expires, generation=None):
+        '''
+        Cache user for cookie, unless generation, the generation before the
+        user was loaded, shows it may have been invalidated since.
+        '''
+        entry = (user.__class__(**user), min(expires, time.time() + self.ttl))
+        with self._lock:
+            if generation is not None and generation != self.generation:
+                return
+            old = self._lru.pop(cookie)
+            if old:
+                self._unindex(cookie, old[0])
+            self._by_user.setdefault(user.id, set()).add(cookie)
+            for k, (u, expires) in self._lru.put(cookie, entry):
+                self._unindex(k, u)
+
+    def invalidate(self, user_id):
+        '''
+        Drop all cookies of user_id.
+        '''
+        with self._lock:
+            self.generation = self.generation + 1
+            for cookie in self._by_user.pop(user_id, ()):
+                self._lru.pop(cookie)
+
+    def clear(self):
+        with self._lock:
+            self._lru.clear()
+            self._by_user.clear()
+
+    def _unindex(self, cookie, user):
+        cookies = self._by_user.get(user.id)
+        if cookies:
+            cookies.discard(cookie)
+            if not cookies:
+                del self._by_user[user.id]
+
+
+cache = SessionCache(configs.session.cache_size, configs.session.cache_ttl)
@@ -150,6 +150,14 @@ function gotoPage(index) {
     }
 }
 
+function gotoCursor(name, cursor) {
+    if (cursor) {
+        var search = location.search.replace(/(page|after|before)\=[^\&]*\&?/g, '');
+        search = (search==='' || search==='?') ? '?' : (search + '&');
+        location.assign(search + name + '=' + encodeURIComponent(cursor));
+    }
+}
+
 function showConfirm(title, text, fn_ok, fn_cancel) {
     var s = '<div id="div-confirm">' +
             '<a href="#0" class="pure-modal-close pure-close"></a>' +
@@ -2,8 +2,8 @@
 # -*- coding: utf-8 -*-
 
 import os, re, time, base64, hashlib, logging
-from lib.web import ctx, get, post, interceptor, view,  seeother, notfound
-import markdown2
+from lib.web import ctx, get, post, interceptor, view, cached, seeother, notfound
+import render, session
 
 from apis import APIError, APIValueError, APIPermissionError, APIResourceNotFoundError, api, Page
 from models import User, Blog
@@ -14,10 +14,29 @@ _COOKIE_KEY = configs.session.secret
 
 
 def _get_blogs_by_page():
-    total = Blog.count_all()
+    return _get_page(Blog)
+
+def _get_page(model):
+    '''
+    Get one page of model, newest first, by the ?after= or ?before= cursor if
+    given, otherwise by ?page= index. Both kinds of page carry the cursors of
+    the adjacent pages, so a client can switch to cursors from any page.
+    '''
+    after = ctx.request.get('after') or None
+    before = ctx.request.get('before') or None
+    if after or before:
+        try:
+            L, next, previous = model.find_page(after=after, before=before)
+            return L, Page.from_cursors(next, previous)
+        except ValueError:
+            pass
+    total = model.count_all()
     page = Page(total, _get_page_index())
-    blogs = Blog.find_by('order by created_at desc limit ?,?', page.offset, page.limit)
-    return blogs, page
+    L = model.find_by('order by created_at desc, `%s` desc limit ?,?' % model.__primary_key__.name, page.offset, page.limit)
+    if L:
+        page.next = model.cursor_of(L[-1]) if page.has_next else None
+        page.previous = model.cursor_of(L[0]) if page.has_previous else None
+    return L, page
 
 def _get_page_index():
     page_index = 1
@@ -57,11 +76,16 @@ def parse_signed_cookie(cookie_str):
         id, expires, md5 = L
         if int(expires) < time.time():
             return None
+        user = session.cache.get(cookie_str)
+        if user:
+            return user
+        generation = session.cache.generation
         user = User.get(id)
         if user is None:
             return None
         if md5 != hashlib.md5('%s-%s-%s-%s' % (id, user.password, expires, _COOKIE_KEY)).hexdigest():
             return None
+        session.cache.put(cookie_str, user, int(expires), generation)
         return user
     except:
         return None
@@ -73,14 +97,24 @@ def manage_interceptor(next):
         return next()
     raise seeother('/signin')
 
+def _invalidate_pages():
+    '''
+    Drop the cached pages when a blog changes: any page may list it. With the
+    in-memory cache this only reaches the current process.
+    '''
+    if ctx.application.response_cache:
+        ctx.application.response_cache.clear()
+
 
 @view('index.html')
 @get('/')
+@cached(ttl=300)
 def index():
     return dict()
 
 @view('blogs.html')
 @get('/blogs')
+@cached(ttl=60, params=('page', 'after', 'before'))
 def blogs():
     blogs, page = _get_blogs_by_page()
     return dict(page=page, blogs=blogs, user=ctx.request.user)
@@ -88,11 +122,14 @@ def blogs():
 
 @view('blog.html')
 @get('/blog/:blog_id')
+@cached(ttl=60)
 def blog(blog_id):
     blog = Blog.get(blog_id)
     if blog is None:
         raise notfound()
-    blog.html_content = markdown2.markdown(blog.content)
+    if not blog.is_rendered():
+        blog.html_content = render.markdown(blog.content)
+    ctx.response.last_modified = max(blog.created_at, getattr(blog, 'updated_at', None) or 0)
     return dict(blog=blog, user=ctx.request.user)
 
 
@@ -176,9 +213,7 @@ _RE_MD5 = re.compile(r'^[0-9a-f]{32}$')
 @api
 @get('/api/users')
 def api_get_users():
-    total = User.count_all()
-    page = Page(total, _get_page_index())
-    users = User.find_by('order by created_at desc limit ?,?', page.offset, page.limit)
+    users, page = _get_page(User)
     for u in users:
         u.password = '******'
     return dict(users=users, page=page)
@@ -213,9 +248,18 @@ def register_user():
 def api_get_blogs():
     format = ctx.request.get('format', '')
     blogs, page = _get_blogs_by_page()
-    if format=='html':
-        for blog in blogs:
-            blog.content = markdown2.markdown(blog.content)
+    L = []
+    for blog in blogs:
+        rendered = blog.is_rendered()
+        html_content = blog.pop('html_content')
+        if format=='html':
+            if rendered:
+                blog.content = html_content
+            else:
+                L.append(blog)
+    # blogs not backfilled yet, or rendered from other content, are rendered in one batch:
+    for blog, html in zip(L, render.markdown_many([blog.content for blog in L])):
+        blog.content = html
     return dict(blogs=blogs, page=page)
 
 
@@ -241,6 +285,7 @@ def api_create_blog():
     user = ctx.request.user
     blog = Blog(name=name, content=content)
     blog.insert()
+    _invalidate_pages()
     return blog
 
 @api
@@ -257,9 +302,13 @@ def api_update_blog(blog_id):
     blog = Blog.get(blog_id)
     if blog is None:
         raise APIResourceNotFoundError('Blog')
+    old_content = blog.content
     blog.name = name
     blog.content = content
     blog.update()
+    if old_content != content:
+        render.evict(old_content)
+    _invalidate_pages()
     return blog
 
 @api
@@ -270,6 +319,8 @@ def api_delete_blog(blog_id):
     if blog is None:
         raise APIResourceNotFoundError('Blog')
     blog.delete()
+    render.evict(blog.content)
+    _invalidate_pages()
     return dict(id=blog_id)
 
 
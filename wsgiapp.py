@@ -8,14 +8,23 @@ except ImportError:
     pass
 
 from lib import db
-from lib.web import WSGIApplication, Jinja2TemplateEngine
+from lib.web import WSGIApplication, Jinja2TemplateEngine, MemoryResponseCache, DiskResponseCache
 from config import configs
+import assets
+import render
 
 import os, time
 from datetime import datetime
 
+# fork the render workers before any database connection or thread exists:
+render.start_pool()
+
 db.engine = db.create_engine_MySQLdb(configs.db.host, configs.db.user, configs.db.password, configs.db.database, configs.db.port)
-wsgi=WSGIApplication(os.path.dirname(os.path.abspath(__file__)))
+if configs.response_cache.dir:
+    response_cache = DiskResponseCache(configs.response_cache.dir, configs.response_cache.capacity)
+else:
+    response_cache = MemoryResponseCache(configs.response_cache.capacity)
+wsgi=WSGIApplication(os.path.dirname(os.path.abspath(__file__)), request_scope=db.request_connection, response_cache=response_cache, serve_static=True)
 
 template_engine=Jinja2TemplateEngine(os.path.join(os.path.dirname(os.path.abspath(__file__)),'templates'))
 
@@ -35,6 +44,7 @@ def datetime_filter(t):
         return u'%s年%s月%s日' % (dt.year, dt.month, dt.day)
 
 template_engine.add_filter('datetime', datetime_filter)
+template_engine.add_global('asset_url', assets.asset_url)
 wsgi.template_engine = template_engine
 
 import urls